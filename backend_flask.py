@@ -4,21 +4,30 @@ Render URL: https://unwanted-mail-sorter.onrender.com
 """
 
 import os
+import hashlib
+import hmac
 import json
 import logging
+import secrets
+import threading
 import time
+import zlib
 from datetime import date
 from abc import ABC, abstractmethod
-import requests
 import jwt
 
 from flask import Flask, request, jsonify, redirect, session
 from flask_cors import CORS
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import razorpay
 
+from explain_service import ExplanationService
+from scorer import InboxAnalytics, apply_model, score_columns, score_email
+from supabase_client import SupabaseClient, UserNotFound
+from token_verifier import GoogleTokenVerifier
+from ttl_cache import TTLCache
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "inboxai-secret-2025")
 
@@ -46,11 +55,35 @@ CORS(app, supports_credentials=True, origins=[
 BACKEND_URL = "https://unwanted-mail-sorter.onrender.com"
 JWT_SECRET = os.environ.get("JWT_SECRET", app.secret_key)
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
+google_verifier = GoogleTokenVerifier(GOOGLE_CLIENT_ID)
 FREE_TIER_DAILY_SCANS = 5
+ACCESS_TOKEN_TTL = 3600
+REFRESH_TOKEN_TTL = 30 * 24 * 3600
+MAX_CLASSIFY_BATCH = 5000
+MAX_CLASSIFY_BYTES = 8 * 1024 * 1024  # after decompression
+# Werkzeug enforces this on every body, including chunked uploads without a
+# Content-Length; read_classify_payload() also bounds its own read.
+app.config["MAX_CONTENT_LENGTH"] = MAX_CLASSIFY_BYTES
+MAX_EXPLAIN_BATCH = 50
+# Default for the "hybrid" flag on /classify: blend the subject model into rule scores.
+HYBRID_SCORING = os.environ.get("HYBRID_SCORING", "0") == "1"
+# Bearer token for /metrics (operators only); the endpoint is disabled without it.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# OPENAI_BASE_URL lets tests and staging point at a local fake LLM server.
+explainer = ExplanationService(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    base_url=os.environ.get("OPENAI_BASE_URL"),
+)
 
 # ── Supabase Config ──────────────────────────────────────────────────────────
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "https://zdjyuqbgpeatbflrkfio.supabase.co")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
+
+# Per-process cache of user rows; writes through this module refresh it.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))
+user_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL)
 
 # ── Payment Abstraction Layer ──────────────────────────────────────────────────
 class PaymentProvider(ABC):
@@ -93,61 +126,79 @@ class RazorpayProvider(PaymentProvider):
 payment_service = RazorpayProvider()
 
 # ── Supabase REST API Functions ──────────────────────────────────────────────
-def get_supabase_headers():
-    return {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
+def _cache_user(email: str, user):
+    if user:
+        user_cache.set(email, dict(user))
+    else:
+        user_cache.invalidate(email)
+    return user
 
 def get_user(email: str):
-    if not SUPABASE_KEY or not SUPABASE_URL: return None
+    cached = user_cache.get(email)
+    if cached is not None:
+        return dict(cached)
+    if not supabase.configured: return None
     try:
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/users?email=eq.{email}",
-            headers=get_supabase_headers()
-        )
-        if response.status_code == 200:
-            data = response.json()
-            return data[0] if data else None
+        return _cache_user(email, supabase.get_user(email))
     except Exception as e:
         logger.error(f"DB Error (get_user): {e}")
     return None
 
 def upsert_user(email: str, data: dict):
-    if not SUPABASE_KEY or not SUPABASE_URL: return None
+    user_cache.invalidate(email)
+    if not supabase.configured: return None
     try:
-        headers = get_supabase_headers()
-        headers["Prefer"] = "resolution=merge-duplicates,return=representation"
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/users",
-            headers=headers,
-            json={"email": email, **data}
-        )
-        if response.status_code in [200, 201]:
-            result = response.json()
-            return result[0] if result else None
+        return _cache_user(email, supabase.upsert_user(email, data))
     except Exception as e:
         logger.error(f"DB Error (upsert_user): {e}")
     return None
 
 def update_user(email: str, data: dict):
-    if not SUPABASE_KEY or not SUPABASE_URL: return None
+    user_cache.invalidate(email)
+    if not supabase.configured: return None
     try:
-        headers = get_supabase_headers()
-        headers["Prefer"] = "return=representation"
-        response = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/users?email=eq.{email}",
-            headers=headers,
-            json=data
-        )
-        if response.status_code == 200:
-            result = response.json()
-            return result[0] if result else None
+        return _cache_user(email, supabase.update_user(email, data))
     except Exception as e:
         logger.error(f"DB Error (update_user): {e}")
     return None
 
+def scans_today(user: dict) -> int:
+    """Scans counted today; a count stored for an earlier day is zero."""
+    if user.get("last_reset_date") != str(date.today()):
+        return 0
+    return user.get("scans_today") or 0
+
+class UsageUnavailable(Exception):
+    """The scan counter could not be reached, so a limited scan cannot be counted."""
+
+def increment_scans(email: str, user: dict):
+    """
+    Count one scan for `email`, enforcing the free-tier limit atomically in
+    the database. Returns the new count, or None if the limit was reached.
+    Without a working database, premium scans go through uncounted and free
+    scans fail closed with UsageUnavailable; a missing users row raises
+    UsageUnavailable for everyone, as it is not a reached limit.
+    """
+    limit = None if user.get("is_premium") else FREE_TIER_DAILY_SCANS
+    today = str(date.today())
+    if not supabase.configured:
+        if limit is not None:
+            raise UsageUnavailable("Supabase not configured")
+        return scans_today(user) + 1
+    try:
+        scans = supabase.increment_scan(email, limit, today)
+    except UserNotFound as e:
+        logger.error(f"DB Error (increment_scans): {e}")
+        raise UsageUnavailable(str(e))
+    except Exception as e:
+        logger.error(f"DB Error (increment_scans): {e}")
+        if limit is not None:
+            raise UsageUnavailable(str(e))
+        return scans_today(user) + 1
+    if scans is not None:
+        _cache_user(email, {**user, "scans_today": scans, "last_reset_date": today})
+    return scans
+
 def check_usage(email: str):
     user = get_user(email)
     today = str(date.today())
@@ -158,36 +209,156 @@ def check_usage(email: str):
             "last_reset_date": today,
         })
         return user or {"is_premium": False, "scans_today": 0}
-    if user.get("last_reset_date") != today:
-        update_user(email, {"scans_today": 0, "last_reset_date": today})
-        user["scans_today"] = 0
-    return user
+    # No reset write on a new day: counts from earlier days read as zero and
+    # the next increment rewrites the day (see supabase/increment_scan.sql).
+    return {**user, "scans_today": scans_today(user)}
+
+# ── Per-User Inbox Analytics ─────────────────────────────────────────────────
+# Running aggregate per user, stored as counts in users.analytics and merged
+# in the database (supabase/merge_analytics.sql), so every worker adds to and
+# reads the same totals. Without Supabase (local development) it is kept in
+# this process. Only POST /analytics adds to it: classifying is read-only, so
+# re-scoring the same messages does not count them twice.
+_local_analytics = {}
+_analytics_lock = threading.Lock()
+
+def merge_user_analytics(email: str, partial: InboxAnalytics):
+    """Add `partial` to the user's aggregate; returns the new snapshot, or None on a DB error."""
+    if not supabase.configured:
+        with _analytics_lock:
+            return _local_analytics.setdefault(email, InboxAnalytics()).merge(partial).snapshot()
+    try:
+        stored = supabase.merge_analytics(email, partial.snapshot())
+    except Exception as e:
+        logger.error(f"DB Error (merge_analytics): {e}")
+        return None
+    return InboxAnalytics.from_snapshot(stored or {}).snapshot()
+
+def user_analytics_snapshot(email: str):
+    if not supabase.configured:
+        with _analytics_lock:
+            return _local_analytics.get(email, InboxAnalytics()).snapshot()
+    try:
+        stored = supabase.get_analytics(email)
+    except Exception as e:
+        logger.error(f"DB Error (get_analytics): {e}")
+        return None
+    return InboxAnalytics.from_snapshot(stored or {}).snapshot()
 
 # ── Authentication Helpers ─────────────────────────────────────────────────────
 def verify_google_token(token):
-    try:
-        idinfo = id_token.verify_oauth2_token(token, google_requests.Request(), GOOGLE_CLIENT_ID)
-        return idinfo['email']
-    except Exception:
-        try:
-            resp = requests.get(f"https://oauth2.googleapis.com/tokeninfo?access_token={token}")
-            if resp.status_code == 200:
-                return resp.json().get("email")
-        except Exception as e:
-            logger.error(f"Auth Error (Google Token): {e}")
-    return None
+    return google_verifier.verify(token)
+
+# Recently verified access tokens (digest -> email), each kept until its exp.
+verified_tokens = TTLCache(maxsize=10_000)
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
 
 def create_backend_token(email):
-    payload = {"email": email, "exp": time.time() + 3600}
+    payload = {"email": email, "exp": time.time() + ACCESS_TOKEN_TTL}
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-def verify_backend_token(token):
+def create_refresh_token(email, jti: str, exp: float = None):
+    payload = {"email": email, "typ": "refresh", "jti": jti, "exp": exp or time.time() + REFRESH_TOKEN_TTL}
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+# ── Refresh Tokens ───────────────────────────────────────────────────────────
+# Each user has one live refresh token, identified by its jti and stored in
+# users.refresh_jti (supabase/refresh_jti.sql). /auth/refresh swaps it for a
+# new one with a compare-and-swap, so a refresh token works once; a used one
+# presented again means it leaked, and the session is revoked. The session's
+# exp is fixed at login and carried over on every rotation. Reads go to the
+# database, not user_cache, so a logout on any worker applies at once.
+# Without Supabase (local development) the jti is kept in this process.
+_local_refresh_jti = {}
+_refresh_lock = threading.Lock()
+
+def current_refresh_jti(email: str):
+    """The jti of the user's live refresh token, or None. Raises on DB errors."""
+    if not supabase.configured:
+        with _refresh_lock:
+            return _local_refresh_jti.get(email)
+    return supabase.get_refresh_jti(email)
+
+def issue_refresh_token(email: str) -> str:
+    """Start a refresh session at login, replacing any earlier one. Raises on DB errors."""
+    jti = secrets.token_urlsafe(16)
+    if supabase.configured:
+        supabase.update_user(email, {"refresh_jti": jti})
+        user_cache.invalidate(email)
+    else:
+        with _refresh_lock:
+            _local_refresh_jti[email] = jti
+    return create_refresh_token(email, jti)
+
+def rotate_refresh_token(payload: dict):
+    """
+    Swap the live jti in `payload` for a new one and return the new refresh
+    token, with the same exp. If the jti is no longer live (reuse, or a
+    revoked session) the session is revoked and None returned. Raises on DB errors.
+    """
+    email, jti = payload["email"], secrets.token_urlsafe(16)
+    if supabase.configured:
+        swapped = supabase.swap_refresh_jti(email, payload["jti"], jti)
+    else:
+        with _refresh_lock:
+            swapped = _local_refresh_jti.get(email) == payload["jti"]
+            if swapped:
+                _local_refresh_jti[email] = jti
+    if not swapped:
+        logger.warning(f"Auth Refresh: {email} presented a used or revoked refresh token, revoking session.")
+        revoke_refresh_tokens(email)
+        return None
+    return create_refresh_token(email, jti, payload["exp"])
+
+def revoke_refresh_tokens(email: str):
+    """Clear the user's live jti; every refresh token issued before stops working."""
+    if not supabase.configured:
+        with _refresh_lock:
+            _local_refresh_jti.pop(email, None)
+        return
+    supabase.update_user(email, {"refresh_jti": None})
+    user_cache.invalidate(email)
+
+def _decode_token(token):
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload.get("email")
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return None
 
+def verify_backend_token(token):
+    key = _token_key(token)
+    email = verified_tokens.get(key)
+    if email:
+        return email
+    payload = _decode_token(token)
+    if not payload or payload.get("typ") == "refresh":
+        return None
+    email = payload.get("email")
+    ttl = payload.get("exp", 0) - time.time()
+    if email and ttl > 0:
+        verified_tokens.set(key, email, ttl=ttl)
+    return email
+
+def _refresh_payload(token):
+    payload = _decode_token(token)
+    if not payload or payload.get("typ") != "refresh" or not payload.get("email") or not payload.get("jti"):
+        return None
+    return payload
+
+def verify_refresh_token(token):
+    """Return the payload of the user's live refresh token, else None (also on DB errors)."""
+    payload = _refresh_payload(token)
+    if not payload:
+        return None
+    try:
+        current = current_refresh_jti(payload["email"])
+    except Exception as e:
+        logger.error(f"DB Error (current_refresh_jti): {e}")
+        return None
+    return payload if payload["jti"] == current else None
+
 def get_authenticated_user():
     auth_header = request.headers.get("Authorization")
     if auth_header and auth_header.startswith("Bearer "):
@@ -202,6 +373,19 @@ def get_authenticated_user():
 def index():
     return "InboxAI backend is running!"
 
+@app.route("/metrics")
+def metrics():
+    auth_header = request.headers.get("Authorization") or ""
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else ""
+    if not METRICS_TOKEN or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return jsonify({"error": "Not authorized"}), 403
+    return jsonify({
+        "user_cache":   user_cache.stats(),
+        "google_token": google_verifier.results.stats(),
+        "backend_token": verified_tokens.stats(),
+        "explanations":  explainer.cache.stats(),
+    })
+
 @app.route("/auth/verify-google", methods=["POST"])
 def auth_verify_google():
     data = request.json or {}
@@ -214,7 +398,51 @@ def auth_verify_google():
         return jsonify({"error": "Invalid Google token"}), 401
     check_usage(email)
     logger.info(f"Auth Success: {email}")
-    return jsonify({"token": create_backend_token(email), "email": email})
+    result = {"token": create_backend_token(email), "email": email}
+    try:
+        result["refresh_token"] = issue_refresh_token(email)
+    except Exception as e:
+        # An unrecorded refresh token could not be checked or revoked; the
+        # client falls back to a silent Google exchange when the JWT expires.
+        logger.error(f"DB Error (issue_refresh_token): {e}")
+    return jsonify(result)
+
+@app.route("/auth/refresh", methods=["POST"])
+def auth_refresh():
+    payload = _refresh_payload((request.json or {}).get("refresh_token") or "")
+    if not payload:
+        return jsonify({"error": "Invalid refresh token"}), 401
+    email = payload["email"]
+    try:
+        refresh_token = rotate_refresh_token(payload)
+    except Exception as e:
+        logger.error(f"DB Error (rotate_refresh_token): {e}")
+        return jsonify({"error": "Refresh failed, try again"}), 503
+    if not refresh_token:
+        return jsonify({"error": "Invalid refresh token"}), 401
+    # Rotate: the client replaces its stored refresh token with the new one.
+    return jsonify({"token": create_backend_token(email), "refresh_token": refresh_token, "email": email})
+
+@app.route("/logout", methods=["POST"])
+def logout():
+    """End the session and revoke every refresh token issued to the user."""
+    email = get_authenticated_user()
+    if not email:
+        payload = verify_refresh_token((request.get_json(silent=True) or {}).get("refresh_token") or "")
+        email = payload and payload["email"]
+    session.pop("user_email", None)
+    auth_header = request.headers.get("Authorization") or ""
+    if auth_header.startswith("Bearer "):
+        verified_tokens.invalidate(_token_key(auth_header[len("Bearer "):]))
+    if not email:
+        return jsonify({"success": True})
+    try:
+        revoke_refresh_tokens(email)
+    except Exception as e:
+        logger.error(f"DB Error (revoke_refresh_tokens): {e}")
+        return jsonify({"error": "Logout failed, try again"}), 503
+    logger.info(f"Auth Logout: {email} revoked refresh tokens.")
+    return jsonify({"success": True})
 
 @app.route("/whoami")
 def whoami():
@@ -232,13 +460,18 @@ def increment_scan():
     email = get_authenticated_user()
     if not email: return jsonify({"error": "Not authenticated"}), 401
     user = check_usage(email)
-    scans_today = user.get("scans_today", 0)
-    if not user.get("is_premium") and scans_today >= FREE_TIER_DAILY_SCANS:
+    if not user.get("is_premium") and user.get("scans_today", 0) >= FREE_TIER_DAILY_SCANS:
+        logger.warning(f"Usage Limit: {email} hit daily scan limit.")
+        return jsonify({"error": "Daily scan limit reached"}), 429
+    try:
+        scans = increment_scans(email, user)
+    except UsageUnavailable:
+        return jsonify({"error": "Usage tracking unavailable, try again shortly"}), 503
+    if scans is None:
         logger.warning(f"Usage Limit: {email} hit daily scan limit.")
         return jsonify({"error": "Daily scan limit reached"}), 429
-    update_user(email, {"scans_today": scans_today + 1})
     logger.info(f"Usage Update: {email} performed a scan.")
-    return jsonify({"success": True, "scans_today": scans_today + 1})
+    return jsonify({"success": True, "scans_today": scans})
 
 @app.route("/usage/validate-cleanup", methods=["POST"])
 def validate_cleanup():
@@ -251,6 +484,118 @@ def validate_cleanup():
         return jsonify({"error": "Free tier limit is 50 emails"}), 403
     return jsonify({"success": True})
 
+# ── Server-Side Classification ─────────────────────────────────────────────────
+class PayloadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _gunzip(raw: bytes, limit: int) -> bytes:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = d.decompress(raw, limit + 1)
+    if len(out) > limit or d.unconsumed_tail:
+        raise PayloadError("Request body too large", 413)
+    return out
+
+def _read_body(limit: int) -> bytes:
+    """Read the request body, at most one byte past `limit` even when chunked."""
+    if (request.content_length or 0) > limit:
+        raise PayloadError("Request body too large", 413)
+    chunks, size = [], 0
+    try:
+        while size <= limit:
+            chunk = request.stream.read(min(64 * 1024, limit + 1 - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+    except RequestEntityTooLarge:
+        raise PayloadError("Request body too large", 413)
+    if size > limit:
+        raise PayloadError("Request body too large", 413)
+    return b"".join(chunks)
+
+def read_classify_payload():
+    """Decode a JSON or msgpack body, optionally gzip-encoded, within size limits."""
+    raw = _read_body(MAX_CLASSIFY_BYTES)
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        try:
+            raw = _gunzip(raw, MAX_CLASSIFY_BYTES)
+        except zlib.error:
+            raise PayloadError("Invalid gzip body")
+    if request.mimetype in ("application/msgpack", "application/x-msgpack"):
+        try:
+            import msgpack
+        except ImportError:
+            raise PayloadError("msgpack not supported", 415)
+        try:
+            return msgpack.unpackb(raw, raw=False)
+        except Exception:
+            raise PayloadError("Invalid msgpack body")
+    try:
+        return json.loads(raw or b"{}")
+    except ValueError:
+        raise PayloadError("Invalid JSON body")
+
+CLASSIFY_FIELDS = ["id", "category", "label", "score", "confidence", "archive"]
+
+@app.route("/classify", methods=["POST"])
+def classify():
+    email = get_authenticated_user()
+    if not email: return jsonify({"error": "Not authenticated"}), 401
+    data = request.json or {}
+    if not isinstance(data, dict) or not isinstance(data.get("headers") or {}, dict):
+        return jsonify({"error": "Expected a JSON object with optional \"headers\": {...}"}), 400
+    result = score_email(
+        subject=data.get("subject", ""),
+        sender=data.get("from", ""),
+        body_snippet=data.get("snippet", ""),
+        headers=data.get("headers") or {},
+    )
+    if data.get("hybrid", HYBRID_SCORING):
+        apply_model([result], [data.get("subject", "")])
+    result.pop("signals")
+    return jsonify({"id": data.get("id"), **result})
+
+@app.route("/classify/batch", methods=["POST"])
+def classify_batch():
+    """
+    Score up to MAX_CLASSIFY_BATCH message summaries in one call. Accepts JSON
+    or msgpack, optionally with Content-Encoding: gzip. Results come back as
+    rows in CLASSIFY_FIELDS order. Analytics are not updated; clients post
+    their totals to /analytics.
+    """
+    email = get_authenticated_user()
+    if not email: return jsonify({"error": "Not authenticated"}), 401
+    try:
+        data = read_classify_payload()
+    except PayloadError as e:
+        return jsonify({"error": str(e)}), e.status
+    emails = data.get("emails") if isinstance(data, dict) else None
+    if not isinstance(emails, list) or not all(isinstance(e, dict) for e in emails):
+        return jsonify({"error": "Expected {\"emails\": [...]}"}), 400
+    if not all(isinstance(e.get("headers") or {}, dict) for e in emails):
+        return jsonify({"error": "Each email's \"headers\" must be an object"}), 400
+    if len(emails) > MAX_CLASSIFY_BATCH:
+        return jsonify({"error": f"At most {MAX_CLASSIFY_BATCH} emails per batch"}), 413
+
+    headers = [e.get("headers") or {} for e in emails]
+    scored = score_columns(
+        [e.get("subject", "") for e in emails],
+        [e.get("from", "") for e in emails],
+        [e.get("snippet", "") for e in emails],
+        list_unsubscribe=[h.get("List-Unsubscribe") for h in headers],
+        precedence=[h.get("Precedence") for h in headers],
+        hybrid=bool(data.get("hybrid", HYBRID_SCORING)),
+    )
+    columns = zip(
+        (e.get("id") for e in emails), scored["category"], scored["label"],
+        scored["score"].tolist(), scored["confidence"].tolist(), scored["archive"].tolist(),
+    )
+    results = [list(row) for row in columns]
+    logger.info(f"Classify: {email} scored {len(results)} emails server-side.")
+    return jsonify({"fields": CLASSIFY_FIELDS, "results": results})
+
 @app.route("/explain-email", methods=["POST"])
 def explain_email():
     email = get_authenticated_user()
@@ -259,25 +604,65 @@ def explain_email():
     if not user.get("is_premium"):
         return jsonify({"error": "Premium feature"}), 403
     
-    openai_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_key: return jsonify({"error": "OpenAI not configured"}), 500
-    
+    if not explainer.configured: return jsonify({"error": "OpenAI not configured"}), 500
+
     data = request.json or {}
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=openai_key)
-        prompt = f"Analyze this email briefly: Subject: {data.get('subject')} From: {data.get('from')} Snippet: {data.get('snippet')}"
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=100
-        )
+        explanation = explainer.explain(data.get('subject'), data.get('from'), data.get('snippet'))
         logger.info(f"AI Feature: {email} requested email explanation.")
-        return jsonify({"explanation": response.choices[0].message.content.strip()})
+        return jsonify({"explanation": explanation})
     except Exception as e:
         logger.error(f"AI Error: {e}")
         return jsonify({"error": "AI service failed"}), 500
 
+@app.route("/explain-emails", methods=["POST"])
+def explain_emails():
+    email = get_authenticated_user()
+    if not email: return jsonify({"error": "Not authenticated"}), 401
+    user = check_usage(email)
+    if not user.get("is_premium"):
+        return jsonify({"error": "Premium feature"}), 403
+    if not explainer.configured: return jsonify({"error": "OpenAI not configured"}), 500
+
+    emails = (request.json or {}).get("emails")
+    if not isinstance(emails, list) or not all(isinstance(e, dict) for e in emails):
+        return jsonify({"error": "Expected {\"emails\": [...]}"}), 400
+    if len(emails) > MAX_EXPLAIN_BATCH:
+        return jsonify({"error": f"At most {MAX_EXPLAIN_BATCH} emails per batch"}), 413
+    try:
+        explanations = explainer.explain_batch(emails)
+        logger.info(f"AI Feature: {email} requested {len(emails)} email explanations.")
+        # Emails not answered before the deadline are null, counted in "incomplete".
+        incomplete = explanations.count(None)
+        if emails and incomplete == len(emails):
+            return jsonify({"error": "AI service timed out"}), 504
+        if incomplete:
+            return jsonify({"explanations": explanations, "incomplete": incomplete})
+        return jsonify({"explanations": explanations})
+    except Exception as e:
+        logger.error(f"AI Error: {e}")
+        return jsonify({"error": "AI service failed"}), 500
+
+@app.route("/analytics", methods=["GET"])
+def get_analytics():
+    email = get_authenticated_user()
+    if not email: return jsonify({"error": "Not authenticated"}), 401
+    snapshot = user_analytics_snapshot(email)
+    if snapshot is None: return jsonify({"error": "Analytics unavailable"}), 503
+    return jsonify(snapshot)
+
+@app.route("/analytics", methods=["POST"])
+def post_analytics():
+    email = get_authenticated_user()
+    if not email: return jsonify({"error": "Not authenticated"}), 401
+    try:
+        partial = InboxAnalytics.from_snapshot(request.json or {})
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid analytics payload"}), 400
+    snapshot = merge_user_analytics(email, partial)
+    if snapshot is None: return jsonify({"error": "Analytics unavailable"}), 503
+    return jsonify(snapshot)
+
 @app.route("/upgrade", methods=["POST"])
 def upgrade():
     email = get_authenticated_user()
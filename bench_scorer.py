@@ -0,0 +1,78 @@
+"""
+InboxAI — Scorer Benchmark
+Builds a synthetic corpus from emails.csv and measures scoring throughput,
+single-process and across the parallel pool for 1..N workers. Every subject
+is made unique and the scorer caches are cleared before each timed run (and
+before workers fork), so the numbers measure scoring, not cache hits.
+
+Usage: python bench_scorer.py [--emails 50000] [--chunk-size 500]
+"""
+
+import argparse
+import csv
+import multiprocessing
+import random
+import time
+
+import scorer
+
+SENDERS = [
+    "noreply@github.com", "newsletter@substack.com", "updates@linkedin.com",
+    "PayPal Security <service@paypa1.com>", "Amazon <ship@amazon.com>",
+    "info@shop.io", "alice@example.com", "bob@work.org",
+]
+SNIPPETS = [
+    "Unsubscribe from these emails", "Your code is 482910",
+    "Limited time offer 50% off flash sale", "Meeting at 3pm via zoom",
+    "Click bit.ly/abc to verify your account", "as discussed, following up",
+    "Your order has shipped, tracking number 1Z", "Weekly digest: top stories", "",
+]
+
+
+def build_corpus(n: int, path: str = "emails.csv") -> list:
+    with open(path, newline="", encoding="utf-8") as f:
+        subjects = [row["subject"] for row in csv.DictReader(f) if row.get("subject")]
+    rng = random.Random(42)
+    return [
+        {
+            "id": str(i),
+            "subject": f"{rng.choice(subjects)} #{i}",
+            "from": rng.choice(SENDERS),
+            "snippet": rng.choice(SNIPPETS),
+            "headers": {"List-Unsubscribe": "<mailto:u@x>"} if rng.random() < 0.2 else {},
+        }
+        for i in range(n)
+    ]
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=50_000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--max-workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.emails)
+    print(f"Corpus: {len(corpus)} emails, {multiprocessing.cpu_count()} cores")
+
+    scorer.clear_caches()
+    base = timed(lambda: scorer.batch_score(corpus))
+    print(f"  batch_score            {len(corpus) / base:>10,.0f} emails/s")
+
+    for workers in range(1, args.max_workers + 1):
+        scorer.clear_caches()  # workers fork from here, so they start cold too
+        scorer.get_pool(workers)  # start workers outside the timed region
+        elapsed = timed(lambda: sum(1 for _ in scorer.score_parallel(corpus, workers, args.chunk_size)))
+        print(f"  score_parallel x{workers:<3}    {len(corpus) / elapsed:>10,.0f} emails/s"
+              f"   speedup {base / elapsed:.2f}x")
+    scorer.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
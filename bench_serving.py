@@ -0,0 +1,161 @@
+"""
+InboxAI — Serving Benchmark
+Runs backend_flask under gunicorn against a local stand-in for Supabase that
+answers every call after a fixed delay, then drives /usage/increment-scan (one
+upstream round trip per request) at increasing client concurrency, once per
+worker class.
+
+Usage: python bench_serving.py [--latency 0.2] [--workers 2] [--concurrency 1,8,32,128]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_SECRET = "bench-secret"
+
+
+class SlowUpstream(ThreadingHTTPServer):
+    """Supabase stand-in: a premium user row, and an increment_scan RPC."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.scans = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                time.sleep(server.latency)
+                if self.path.startswith("/rest/v1/rpc/increment_scan"):
+                    with server.lock:
+                        server.scans += 1
+                        payload = server.scans
+                else:
+                    payload = [{"email": BENCH_EMAIL, "is_premium": True, "scans_today": 0}]
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(worker_class: str, workers: int, upstream_url: str):
+    port = free_port()
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "WEB_CONCURRENCY": str(workers),
+        "SUPABASE_URL": upstream_url,
+        "SUPABASE_KEY": "bench",
+        "JWT_SECRET": BENCH_SECRET,
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning",
+         "backend_flask:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return proc, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+
+def run_load(url: str, concurrency: int, total: int, token: str):
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def one(_):
+        start = time.perf_counter()
+        resp = session.post(f"{url}/usage/increment-scan", headers=headers, timeout=120)
+        return time.perf_counter() - start, resp.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(r[0] for r in results)
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "errors": sum(not ok for _, ok in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated upstream delay in seconds")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", default="1,8,32,128")
+    parser.add_argument("--requests", type=int, default=0, help="requests per level (default 4x concurrency, min 20)")
+    parser.add_argument("--worker-classes", default="sync,gevent")
+    args = parser.parse_args()
+
+    upstream = SlowUpstream(args.latency)
+    token = jwt.encode({"email": BENCH_EMAIL, "exp": time.time() + 3600}, BENCH_SECRET, algorithm="HS256")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    print(f"Upstream latency {args.latency * 1000:.0f} ms, {args.workers} gunicorn workers")
+    print(f"{'worker':<8} {'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+
+    for worker_class in args.worker_classes.split(","):
+        proc, url = start_backend(worker_class, args.workers, upstream.url)
+        try:
+            for concurrency in levels:
+                total = args.requests or max(20, concurrency * 4)
+                r = run_load(url, concurrency, total, token)
+                print(f"{worker_class:<8} {concurrency:>8} {r['rps']:>9.1f} "
+                      f"{r['p50'] * 1000:>9.0f} {r['p95'] * 1000:>9.0f} {r['errors']:>7}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+InboxAI — Usage Counter Compaction
+Zeroes scan counters left over from earlier days in one bulk update.
+Readers already treat stale counts as zero, so this is housekeeping only and
+can run at any quiet hour (e.g. a daily cron job).
+
+Usage: SUPABASE_URL=... SUPABASE_KEY=... python compact_usage.py
+"""
+
+import os
+import sys
+
+from supabase_client import SupabaseClient
+
+if __name__ == "__main__":
+    client = SupabaseClient(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY"))
+    if not client.configured:
+        print(__doc__)
+        sys.exit(1)
+    client.reset_stale_counters()
+    print("✅ Stale scan counters reset")
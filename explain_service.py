@@ -0,0 +1,177 @@
+"""
+InboxAI — Email Explanation Service
+Premium OpenAI explanations with one reused client, a content-hash cache,
+coalescing of concurrent identical requests, and batching of many emails
+into a single prompt.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+CACHE_TTL = 24 * 3600
+MAX_TOKENS = 100
+BATCH_PROMPT_SIZE = 10   # emails per batched prompt
+REQUEST_TIMEOUT = 20
+MAX_RETRIES = 2          # OpenAI client retries on connection errors, 429 and 5xx
+RETRY_BACKOFF_MAX = 8    # the client's cap on the sleep between retries
+# A coalesced waiter gives up only after the owner could have: every attempt
+# timing out, plus the backoff between attempts.
+WAIT_TIMEOUT = (MAX_RETRIES + 1) * REQUEST_TIMEOUT + MAX_RETRIES * RETRY_BACKOFF_MAX
+# explain_batch answers within this many seconds, inside gunicorn's 60 s timeout;
+# emails still unanswered by then come back as None.
+BATCH_DEADLINE = 45
+
+logger = logging.getLogger("inboxai")
+
+
+def _prompt(subject, sender, snippet) -> str:
+    return f"Analyze this email briefly: Subject: {subject} From: {sender} Snippet: {snippet}"
+
+
+def _batch_prompt(emails: list) -> str:
+    lines = [
+        f"{i + 1}. Subject: {e.get('subject')} From: {e.get('from')} Snippet: {e.get('snippet')}"
+        for i, e in enumerate(emails)
+    ]
+    return (
+        "Analyze each of these emails briefly. Reply with only a JSON array of "
+        f"{len(emails)} strings, one short explanation per email, in order.\n" + "\n".join(lines)
+    )
+
+
+class ExplanationService:
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = DEFAULT_MODEL,
+                 cache_ttl: float = CACHE_TTL, cache_size: int = 10_000):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._client = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, timeout=REQUEST_TIMEOUT,
+                                  max_retries=MAX_RETRIES)
+        return self._client
+
+    @staticmethod
+    def content_key(subject, sender, snippet) -> str:
+        raw = json.dumps([subject, sender, snippet], ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _complete(self, prompt: str, max_tokens: int) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content.strip()
+
+    def explain(self, subject, sender, snippet) -> str:
+        """
+        Explain one email. Identical emails are answered from the cache, and
+        concurrent requests for the same email share one upstream call.
+        """
+        key = self.content_key(subject, sender, snippet)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = concurrent.futures.Future()
+        if not owner:
+            return future.result(timeout=WAIT_TIMEOUT)
+
+        try:
+            text = self._complete(_prompt(subject, sender, snippet), MAX_TOKENS)
+            self.cache.set(key, text)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _explain_chunk(self, emails: list):
+        """One batched prompt; None if the reply can't be parsed."""
+        try:
+            reply = self._complete(_batch_prompt(emails), MAX_TOKENS * len(emails))
+            texts = json.loads(reply)
+            if not (isinstance(texts, list) and len(texts) == len(emails)):
+                raise ValueError("batched reply has the wrong shape")
+        except ValueError as err:
+            logger.warning(f"AI Batch: falling back to single calls ({err})")
+            return None
+        return texts
+
+    def explain_batch(self, emails: list, deadline: float = BATCH_DEADLINE) -> list:
+        """
+        Explain many emails, BATCH_PROMPT_SIZE per prompt. Cached and duplicate
+        emails cost nothing; if a batched reply can't be parsed, the affected
+        emails fall back to one call each. Prompts run concurrently, and emails
+        without an answer after `deadline` seconds come back as None. Answers
+        from a batched prompt are not cached: the shared cache only holds
+        single-email explanations.
+        """
+        keys = [self.content_key(e.get("subject"), e.get("from"), e.get("snippet")) for e in emails]
+        found = {}
+        pending = {}
+        for key, e in zip(keys, emails):
+            cached = self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                pending.setdefault(key, e)
+
+        todo = list(pending.items())
+        end = time.monotonic() + deadline
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_PROMPT_SIZE)
+        try:
+            batched = {}
+            for i in range(0, len(todo), BATCH_PROMPT_SIZE):
+                chunk = todo[i:i + BATCH_PROMPT_SIZE]
+                batched[pool.submit(self._explain_chunk, [e for _, e in chunk])] = chunk
+
+            singles = {}
+            try:
+                for future in concurrent.futures.as_completed(batched, timeout=max(0, end - time.monotonic())):
+                    chunk, texts = batched[future], future.result()
+                    if texts is None:
+                        for key, e in chunk:
+                            singles[pool.submit(self.explain, e.get("subject"), e.get("from"), e.get("snippet"))] = key
+                        continue
+                    for (key, _), text in zip(chunk, texts):
+                        found[key] = str(text).strip()
+            except concurrent.futures.TimeoutError:
+                pass
+            done, _ = concurrent.futures.wait(singles, timeout=max(0, end - time.monotonic()))
+            for future in done:
+                found[singles[future]] = future.result()
+        finally:
+            # Calls still running finish in the background; explain() caches what they return.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        missing = len(set(keys) - found.keys())
+        if missing:
+            logger.warning(f"AI Batch: {missing} emails unanswered after {deadline}s")
+        return [found.get(key) for key in keys]
@@ -7,8 +7,9 @@ console.log("InboxAI service worker started.");
 // ── Config ─────────────────────────────────────────────────────────────────────
 const BACKEND = "https://unwanted-mail-sorter.onrender.com";
 
-// Cache for the backend JWT
+// Cache for the backend JWT and the long-lived refresh token
 let backendToken = null;
+let refreshToken = null;
 
 /**
  * Perform a login/token-exchange flow.
@@ -49,7 +50,8 @@ async function performAuthExchange(interactive = false) {
                 const data = await response.json();
                 if (data.token) {
                     backendToken = data.token;
-                    await chrome.storage.local.set({ backendToken: data.token });
+                    refreshToken = data.refresh_token || null;
+                    await chrome.storage.local.set({ backendToken: data.token, refreshToken });
                     resolve({ token: data.token, email: data.email });
                 } else {
                     throw new Error(data.error || "No token in response");
@@ -62,6 +64,30 @@ async function performAuthExchange(interactive = false) {
     });
 }
 
+/**
+ * Exchange the stored refresh token for a new backend JWT.
+ * Avoids a full Google re-verification when only the 1-hour JWT expired.
+ */
+async function refreshBackendToken() {
+    if (!refreshToken) return false;
+    const response = await fetch(`${BACKEND}/auth/refresh`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ refresh_token: refreshToken })
+    });
+    if (!response.ok) {
+        refreshToken = null;
+        await chrome.storage.local.remove("refreshToken");
+        return false;
+    }
+    const data = await response.json();
+    backendToken = data.token;
+    // Refresh tokens rotate: keep the one issued with this JWT.
+    refreshToken = data.refresh_token || refreshToken;
+    await chrome.storage.local.set({ backendToken, refreshToken });
+    return true;
+}
+
 /**
  * Reusable fetch helper for backend requests with auto-refresh.
  */
@@ -79,8 +105,10 @@ async function backendFetch(path, options = {}) {
     if (response.status === 401 && backendToken) {
         console.log("Backend JWT expired. Attempting refresh...");
         try {
-            // 1. Attempt silent refresh first
-            await performAuthExchange(false);
+            // 1. Use the refresh token, falling back to a silent Google exchange
+            if (!(await refreshBackendToken())) {
+                await performAuthExchange(false);
+            }
             
             // Retry the original request with new token
             headers["Authorization"] = `Bearer ${backendToken}`;
@@ -99,7 +127,8 @@ async function backendFetch(path, options = {}) {
             } catch (interactiveError) {
                 console.error("Authentication recovery failed:", interactiveError);
                 backendToken = null;
-                await chrome.storage.local.remove("backendToken");
+                refreshToken = null;
+                await chrome.storage.local.remove(["backendToken", "refreshToken"]);
             }
         }
     }
@@ -250,22 +279,33 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
     }
     
     if (message.action === "logout") {
-        backendToken = null;
-        chrome.storage.local.remove("backendToken");
-        // Also clear chrome identity cache
-        chrome.identity.getAuthToken({ interactive: false }, (token) => {
-            if (token) {
-                chrome.identity.removeCachedAuthToken({ token: token });
-            }
+        // Revoke the refresh token server-side before forgetting it locally
+        const headers = { "Content-Type": "application/json" };
+        if (backendToken) headers["Authorization"] = `Bearer ${backendToken}`;
+        fetch(`${BACKEND}/logout`, {
+            method: "POST",
+            headers,
+            body: JSON.stringify({ refresh_token: refreshToken })
+        }).catch((error) => console.warn("Backend logout failed:", error)).finally(() => {
+            backendToken = null;
+            refreshToken = null;
+            chrome.storage.local.remove(["backendToken", "refreshToken"]);
+            // Also clear chrome identity cache
+            chrome.identity.getAuthToken({ interactive: false }, (token) => {
+                if (token) {
+                    chrome.identity.removeCachedAuthToken({ token: token });
+                }
+            });
+            sendResponse({ success: true });
         });
-        sendResponse({ success: true });
         return true;
     }
 });
 
 // Load token from storage on startup
-chrome.storage.local.get(["backendToken"], (res) => {
+chrome.storage.local.get(["backendToken", "refreshToken"], (res) => {
     if (res.backendToken) backendToken = res.backendToken;
+    if (res.refreshToken) refreshToken = res.refreshToken;
 });
 
 chrome.runtime.onInstalled.addListener(() => {
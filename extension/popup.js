@@ -183,10 +183,7 @@ btnLogin.addEventListener("click", () => {
 // ── Logout ────────────────────────────────────────────────────────────────────
 btnLogout.addEventListener("click", async () => {
     showLoading("Signing out...");
-    // 1. Backend logout (for session)
-    await api("/logout", { method: "POST" }).catch(() => {});
-    
-    // 2. Extension logout (for token)
+    // Extension logout: revokes the refresh token on the backend, then clears it
     chrome.runtime.sendMessage({ action: "logout" }, async () => {
         await clearCachedUser();
         userBadge.classList.add("hidden");
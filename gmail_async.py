@@ -0,0 +1,216 @@
+"""
+InboxAI — Async Gmail Client
+asyncio client for the Gmail REST API, for multi-account cleanup workers that
+are bound by network latency. One pooled aiohttp session per client, a cap on
+requests in flight, and a token bucket sized in Gmail quota units that backs
+off on 429/5xx responses, dropped connections and timeouts.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import random
+import time
+
+import aiohttp
+
+from gmail_utils import BATCH_MODIFY_SIZE, LIST_PAGE_SIZE, METADATA_HEADERS, _parse_metadata
+
+GMAIL_API = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+# Per-method cost in Gmail quota units, and the per-user budget per second.
+QUOTA_UNITS = {
+    "messages.list":        5,
+    "messages.get":         5,
+    "messages.modify":      5,
+    "messages.batchModify": 50,
+    "labels.list":          1,
+    "history.list":         2,
+}
+USER_QUOTA_PER_SECOND = 250
+
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger("inboxai.gmail")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` units per second. On throttling the rate
+    is halved; each success adds back a little, up to the configured maximum.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, units: float):
+        if units > self.capacity:
+            raise ValueError(f"TokenBucket: {units} units can never fit a capacity of {self.capacity}")
+        async with self._lock:
+            self._refill()
+            while self._tokens < units:
+                await asyncio.sleep((units - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= units
+
+    def slow_down(self):
+        self.rate = max(self.max_rate / 32, self.rate / 2)
+
+    def speed_up(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class GmailAPIError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Gmail API error {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+
+
+class AsyncGmailClient:
+    """
+    Use as `async with AsyncGmailClient(token) as gmail: ...`.
+    `token` is an access token string or a callable (sync or async) that
+    returns a current one, e.g. a wrapper that refreshes google Credentials.
+    """
+
+    def __init__(self, token, concurrency: int = 100, quota_per_second: float = USER_QUOTA_PER_SECOND,
+                 base_url: str = GMAIL_API, timeout: float = 30):
+        self._token = token
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # A bucket smaller than the costliest call (batchModify) would never fill up for it.
+        self.bucket = TokenBucket(quota_per_second, max(quota_per_second, *QUOTA_UNITS.values()))
+        self._sem = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _access_token(self) -> str:
+        if not callable(self._token):
+            return self._token
+        token = self._token()
+        return await token if inspect.isawaitable(token) else token
+
+    async def _request(self, op: str, method: str, path: str, params=None, body=None):
+        for attempt in range(MAX_RETRIES + 1):
+            await self.bucket.acquire(QUOTA_UNITS[op])
+            error = retry_after = None
+            try:
+                async with self._sem:
+                    headers = {"Authorization": f"Bearer {await self._access_token()}"}
+                    async with self._session.request(
+                        method, f"{self.base_url}/{path}", params=params, json=body, headers=headers
+                    ) as resp:
+                        text = await resp.text()
+                        status = resp.status
+                        retry_after = resp.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Dropped connections and timeouts are transient, like a 5xx.
+                error = e
+            else:
+                throttled = status in RETRY_STATUSES or (status == 403 and "ateLimitExceeded" in text)
+                if not throttled:
+                    if status >= 400:
+                        raise GmailAPIError(status, text)
+                    self.bucket.speed_up()
+                    return json.loads(text) if text else None
+
+            self.bucket.slow_down()
+            if attempt == MAX_RETRIES:
+                if error is not None:
+                    raise error
+                raise GmailAPIError(status, text)
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else min(32, 2 ** attempt)
+            reason = status if error is None else type(error).__name__
+            logger.warning(f"Gmail Throttled: {op} got {reason}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay + random.random())
+
+    # ── Operations ─────────────────────────────────────────────────────────────
+    async def list_messages(self, query: str = None, label_ids: list = None, max_results: int = None) -> list:
+        """Return message IDs, following nextPageToken."""
+        ids = []
+        page_token = None
+        while max_results is None or len(ids) < max_results:
+            page_size = LIST_PAGE_SIZE if max_results is None else min(LIST_PAGE_SIZE, max_results - len(ids))
+            params = [("maxResults", page_size)]
+            if query:
+                params.append(("q", query))
+            for label_id in label_ids or []:
+                params.append(("labelIds", label_id))
+            if page_token:
+                params.append(("pageToken", page_token))
+            resp = await self._request("messages.list", "GET", "messages", params=params)
+            ids.extend(m["id"] for m in resp.get("messages", []))
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+        return ids
+
+    async def get_message(self, msg_id: str, format: str = "metadata") -> dict:
+        params = [("format", format)]
+        if format == "metadata":
+            params += [("metadataHeaders", h) for h in METADATA_HEADERS]
+        return await self._request("messages.get", "GET", f"messages/{msg_id}", params=params)
+
+    async def get_messages_metadata(self, msg_ids: list) -> list:
+        """
+        Fetch many messages concurrently; returns scorer-ready dicts in order.
+        Messages that still fail after retries (e.g. 404 for a deleted one)
+        are logged and skipped, as in gmail_utils.fetch_metadata_batch.
+        """
+        msgs = await asyncio.gather(*(self.get_message(m) for m in msg_ids), return_exceptions=True)
+        results = []
+        for msg_id, msg in zip(msg_ids, msgs):
+            if isinstance(msg, (GmailAPIError, aiohttp.ClientError, asyncio.TimeoutError)):
+                logger.error(f"Gmail Error (get {msg_id}): {msg}")
+            elif isinstance(msg, BaseException):
+                raise msg
+            else:
+                results.append(_parse_metadata(msg))
+        return results
+
+    async def modify_message(self, msg_id: str, add_label_ids=(), remove_label_ids=()):
+        body = {"addLabelIds": list(add_label_ids), "removeLabelIds": list(remove_label_ids)}
+        return await self._request("messages.modify", "POST", f"messages/{msg_id}/modify", body=body)
+
+    async def batch_modify(self, msg_ids: list, add_label_ids=(), remove_label_ids=()):
+        """users.messages.batchModify in chunks of up to 1,000 IDs."""
+        await asyncio.gather(*(
+            self._request("messages.batchModify", "POST", "messages/batchModify", body={
+                "ids": msg_ids[i:i + BATCH_MODIFY_SIZE],
+                "addLabelIds": list(add_label_ids),
+                "removeLabelIds": list(remove_label_ids),
+            })
+            for i in range(0, len(msg_ids), BATCH_MODIFY_SIZE)
+        ))
+
+    async def list_labels(self) -> list:
+        resp = await self._request("labels.list", "GET", "labels")
+        return resp.get("labels", [])
@@ -1,14 +1,32 @@
 import os
 import base64
+import logging
+import random
 import re
+import time
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 # If modifying scopes, delete token.json
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
+# Only the headers scoring needs; format=metadata skips the message body.
+METADATA_HEADERS = ["Subject", "From", "List-Unsubscribe", "Precedence"]
+# Gmail accepts up to 100 calls per batch request but throttles batches
+# larger than 50, so stay at 50 and pace them against the per-user quota.
+BATCH_SIZE = 50
+USER_QUOTA_PER_SECOND = 250  # Gmail quota units per user per second
+GET_QUOTA_UNITS = 5          # cost of one users.messages.get
+LIST_PAGE_SIZE = 500    # max page size for messages.list
+MAX_RETRIES = 5
+BATCH_MODIFY_SIZE = 1000  # max IDs per users.messages.batchModify call
+LABEL_CACHE_TTL = 3600
+
+logger = logging.getLogger("inboxai.gmail")
+
 def authenticate_gmail():
     """Authenticate Gmail API and return service object."""
     creds = None
@@ -27,43 +45,326 @@ def authenticate_gmail():
     return service
 
 
-def fetch_recent_emails(service, max_results=10):
-    """Fetch recent emails with subject lines."""
-    results = service.users().messages().list(userId="me", maxResults=max_results).execute()
-    messages = results.get("messages", [])
-    emails = []
-
-    for msg in messages:
-        msg_data = service.users().messages().get(userId="me", id=msg["id"]).execute()
-        headers = msg_data.get("payload", {}).get("headers", [])
-        subject = ""
-        for h in headers:
-            if h["name"].lower() == "subject":
-                subject = h["value"]
-        emails.append({"id": msg["id"], "subject": subject})
-    return emails
-
-
-def move_to_label(service, msg_id, label_name="Filtered-Unwanted"):
-    """Move an email to a label, creating it if needed."""
-    # Check if label exists
-    labels_res = service.users().labels().list(userId="me").execute()
-    labels = labels_res.get("labels", [])
-    label_id = None
-
-    for l in labels:
-        if l["name"].lower() == label_name.lower():
-            label_id = l["id"]
-
-    # Create if not exists
-    if not label_id:
+def _is_retryable(error) -> bool:
+    """Rate-limit and transient server errors are worth retrying."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status in (429, 500, 502, 503, 504):
+        return True
+    return status == 403 and b"ateLimitExceeded" in (error.content or b"")
+
+
+def _backoff(attempt: int):
+    time.sleep(min(32, 2 ** attempt) + random.random())
+
+
+class QuotaPacer:
+    """Spaces out calls so they average at most `rate` quota units per second."""
+
+    def __init__(self, rate: float = USER_QUOTA_PER_SECOND):
+        self.rate = rate
+        self._next = time.monotonic()
+
+    def wait(self, units: float):
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(now, self._next) + units / self.rate
+
+
+def _execute_batch(batch, units: float, pacer: QuotaPacer):
+    """Execute a batch request, retrying when the batch call itself is throttled."""
+    for attempt in range(MAX_RETRIES + 1):
+        pacer.wait(units)
+        try:
+            return batch.execute()
+        except HttpError as e:
+            if not _is_retryable(e) or attempt == MAX_RETRIES:
+                raise
+            logger.warning(f"Gmail Throttled: batch got {e.resp.status}, retrying")
+            _backoff(attempt)
+
+
+def list_message_ids(service, query: str = None, label_ids: list = None, max_results: int = None):
+    """Yield message IDs newest first, following nextPageToken across pages."""
+    page_token = None
+    remaining = max_results
+    while remaining is None or remaining > 0:
+        page_size = LIST_PAGE_SIZE if remaining is None else min(LIST_PAGE_SIZE, remaining)
+        kwargs = {"userId": "me", "maxResults": page_size}
+        if query:
+            kwargs["q"] = query
+        if label_ids:
+            kwargs["labelIds"] = label_ids
+        if page_token:
+            kwargs["pageToken"] = page_token
+        resp = service.users().messages().list(**kwargs).execute(num_retries=MAX_RETRIES)
+        messages = resp.get("messages", [])
+        for msg in messages:
+            yield msg["id"]
+        if remaining is not None:
+            remaining -= len(messages)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _parse_metadata(msg: dict) -> dict:
+    headers = {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+    extra = {}
+    for name in ("List-Unsubscribe", "Precedence"):
+        if name.lower() in headers:
+            extra[name] = headers[name.lower()]
+    return {
+        "id":       msg["id"],
+        "threadId": msg.get("threadId"),
+        "subject":  headers.get("subject", ""),
+        "from":     headers.get("from", ""),
+        "snippet":  msg.get("snippet", ""),
+        "headers":  extra,
+    }
+
+
+def fetch_metadata_batch(service, msg_ids: list, batch_size: int = BATCH_SIZE, pacer: QuotaPacer = None) -> list:
+    """
+    Fetch subject/sender/snippet for many messages via HTTP batch requests,
+    `batch_size` gets per round trip, paced to the per-user quota. Calls
+    rejected for rate limits, inside a batch or the whole batch, are retried
+    with exponential backoff. Returns dicts in `msg_ids` order.
+    """
+    msg_ids = list(dict.fromkeys(msg_ids))
+    pacer = pacer or QuotaPacer()
+    results = {}
+    pending = msg_ids
+    for attempt in range(MAX_RETRIES + 1):
+        retry = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                results[request_id] = _parse_metadata(response)
+            elif _is_retryable(exception):
+                retry.append(request_id)
+            else:
+                logger.error(f"Gmail Error (get {request_id}): {exception}")
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = service.new_batch_http_request(callback=on_response)
+            for msg_id in chunk:
+                batch.add(
+                    service.users().messages().get(
+                        userId="me", id=msg_id, format="metadata", metadataHeaders=METADATA_HEADERS
+                    ),
+                    request_id=msg_id,
+                )
+            _execute_batch(batch, len(chunk) * GET_QUOTA_UNITS, pacer)
+
+        if not retry:
+            break
+        if attempt == MAX_RETRIES:
+            logger.error(f"Gmail Error: giving up on {len(retry)} rate-limited messages")
+            break
+        _backoff(attempt)
+        pending = list(dict.fromkeys(retry))
+
+    return [results[m] for m in msg_ids if m in results]
+
+
+def list_history_message_ids(service, start_history_id, label_id: str = "INBOX"):
+    """
+    Return (message_ids, latest_history_id) for messages added to `label_id`
+    since `start_history_id`. Raises HttpError 404 once the ID has expired.
+    """
+    ids = []
+    latest = start_history_id
+    page_token = None
+    while True:
+        kwargs = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded"],
+            "labelId": label_id,
+            "maxResults": LIST_PAGE_SIZE,
+        }
+        if page_token:
+            kwargs["pageToken"] = page_token
+        resp = service.users().history().list(**kwargs).execute(num_retries=MAX_RETRIES)
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg = added["message"]
+                if label_id in msg.get("labelIds", [label_id]):
+                    ids.append(msg["id"])
+        latest = resp.get("historyId", latest)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return list(dict.fromkeys(ids)), latest
+
+
+def sync_mailbox(service, store, account: str = "me", label_id: str = "INBOX", full_sync_limit: int = None):
+    """
+    Fetch messages that arrived since the last sync of `account`.
+
+    Uses users.history.list from the history ID saved in `store` (a
+    message_store.MessageStore). Without a saved ID, or once it has expired,
+    falls back to a full listing of `label_id`. Already-processed messages are
+    skipped either way.
+
+    Returns (emails, history_id). Save the ID with
+    store.set_history_id(account, history_id) once the emails are processed,
+    so a crash mid-run re-delivers them instead of losing them.
+    """
+    start = store.get_history_id(account)
+    ids = None
+    if start:
+        try:
+            ids, history_id = list_history_message_ids(service, start, label_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.info(f"Gmail Sync: history {start} expired for {account}, running full resync")
+
+    if ids is None:
+        # Read the history ID first so nothing arriving mid-listing is missed.
+        history_id = service.users().getProfile(userId="me").execute(num_retries=MAX_RETRIES)["historyId"]
+        ids = list(list_message_ids(service, label_ids=[label_id], max_results=full_sync_limit))
+
+    return fetch_metadata_batch(service, store.filter_unprocessed(ids)), history_id
+
+
+def fetch_recent_emails(service, max_results=10, query=None):
+    """Fetch recent emails with subject, sender, snippet and scoring headers."""
+    ids = list(list_message_ids(service, query=query, max_results=max_results))
+    return fetch_metadata_batch(service, ids)
+
+
+class LabelResolver:
+    """
+    Caches label name -> ID for one account, so label lookups cost one
+    labels.list per TTL instead of one per message. Call invalidate() after
+    labels are changed outside this process.
+    """
+
+    def __init__(self, service, ttl: float = LABEL_CACHE_TTL):
+        self.service = service
+        self.ttl = ttl
+        self._ids = {}
+        self._loaded_at = None
+
+    def invalidate(self):
+        self._ids = {}
+        self._loaded_at = None
+
+    def _load(self):
+        labels = self.service.users().labels().list(userId="me").execute(num_retries=MAX_RETRIES)
+        self._ids = {l["name"].lower(): l["id"] for l in labels.get("labels", [])}
+        self._loaded_at = time.monotonic()
+
+    def _fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def resolve(self, label_name: str, create: bool = True):
+        """Return the label ID for `label_name`, creating the label if needed."""
+        key = label_name.lower()
+        if not self._fresh() or key not in self._ids:
+            self._load()
+        if key in self._ids or not create:
+            return self._ids.get(key)
+
         label_obj = {"name": label_name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
-        new_label = service.users().labels().create(userId="me", body=label_obj).execute()
-        label_id = new_label["id"]
+        try:
+            new_label = self.service.users().labels().create(userId="me", body=label_obj).execute()
+        except HttpError as e:
+            if e.resp.status != 409:
+                raise
+            # Created concurrently by someone else; pick it up from a fresh list.
+            self._load()
+            return self._ids.get(key)
+        self._ids[key] = new_label["id"]
+        return new_label["id"]
+
+
+_label_resolvers = {}
+
+
+def get_label_resolver(service, account: str) -> LabelResolver:
+    """
+    Return the shared resolver for `account`, bound to the latest service.
+    `account` must be the mailbox's address: label IDs are per mailbox and
+    often collide (Label_1, Label_2, ...), so "me" would share one cache
+    between every account.
+    """
+    if not account or account == "me":
+        raise ValueError("get_label_resolver: account must be the mailbox address, not 'me'")
+    resolver = _label_resolvers.get(account)
+    if resolver is None:
+        resolver = _label_resolvers[account] = LabelResolver(service)
+    resolver.service = service
+    return resolver
+
+
+def _with_label(resolver: LabelResolver, label_name: str, label_id: str, send) -> str:
+    """
+    Call send(label_id). If Gmail rejects the cached ID as invalid (400/404,
+    e.g. the label was deleted or renamed elsewhere), drop the cache, resolve
+    `label_name` again and retry once. Returns the label ID that worked.
+    """
+    try:
+        send(label_id)
+        return label_id
+    except HttpError as e:
+        if e.resp.status not in (400, 404):
+            raise
+        logger.info(f"Gmail Labels: {label_name} ({label_id}) rejected with {e.resp.status}, resolving again")
+    resolver.invalidate()
+    label_id = resolver.resolve(label_name)
+    send(label_id)
+    return label_id
+
+
+def move_to_label(service, msg_id, label_name="Filtered-Unwanted", *, account):
+    """Move an email in `account`'s mailbox to a label, creating it if needed."""
+    resolver = get_label_resolver(service, account)
 
     # Move message
-    service.users().messages().modify(
-        userId="me",
-        id=msg_id,
-        body={"addLabelIds": [label_id], "removeLabelIds": ["INBOX"]}
-    ).execute()
+    def send(label_id):
+        service.users().messages().modify(
+            userId="me",
+            id=msg_id,
+            body={"addLabelIds": [label_id], "removeLabelIds": ["INBOX"]}
+        ).execute()
+
+    _with_label(resolver, label_name, resolver.resolve(label_name), send)
+
+
+def bulk_move(service, moves, *, account, remove_label_ids=("INBOX",)) -> dict:
+    """
+    Move many messages with users.messages.batchModify.
+    `moves` is an iterable of (msg_id, label_name) pairs; IDs are grouped by
+    target label and sent in chunks of up to 1,000. A cached label ID that
+    Gmail rejects is resolved again. Returns {label: count}.
+    """
+    by_label = {}
+    for msg_id, label_name in moves:
+        by_label.setdefault(label_name, []).append(msg_id)
+
+    resolver = get_label_resolver(service, account)
+    moved = {}
+    for label_name, ids in by_label.items():
+        label_id = resolver.resolve(label_name)
+        for i in range(0, len(ids), BATCH_MODIFY_SIZE):
+            chunk = ids[i:i + BATCH_MODIFY_SIZE]
+
+            def send(label_id):
+                service.users().messages().batchModify(
+                    userId="me",
+                    body={
+                        "ids": chunk,
+                        "addLabelIds": [label_id],
+                        "removeLabelIds": list(remove_label_ids),
+                    },
+                ).execute(num_retries=MAX_RETRIES)
+
+            label_id = _with_label(resolver, label_name, label_id, send)
+        moved[label_name] = len(ids)
+    return moved
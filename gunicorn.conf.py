@@ -0,0 +1,25 @@
+"""
+InboxAI — Gunicorn Config
+Every route waits on Supabase, Google or OpenAI over HTTP, so the default
+workers are gevent: gunicorn monkey-patches the worker before the app is
+imported, which makes requests/httpx socket I/O cooperative and lets one
+process hold many slow upstream calls at once.
+
+Set GUNICORN_WORKER_CLASS=sync to fall back to blocking workers.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Concurrent requests per gevent worker; ignored by sync workers.
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 200))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Not preloaded: the app must be imported after gevent has patched the worker,
+# otherwise sockets and locks created at import time stay blocking.
+preload_app = False
+accesslog = None
@@ -0,0 +1,272 @@
+"""
+InboxAI — Processed Message Store
+SQLite-backed replacement for processed_ids.json / classified_emails.json.
+Membership checks are indexed lookups and writes are transactional, so a
+crash mid-write leaves the previous state intact.
+
+Usage: python message_store.py migrate [DB_PATH]
+  Imports processed_ids.json and classified_emails.json into the store.
+       python message_store.py rescore [DB_PATH]
+  Re-scores stored feature records with the current rules and updates labels.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+DEFAULT_DB_PATH = "messages.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS classifications (
+    id         TEXT PRIMARY KEY,
+    subject    TEXT,
+    label      TEXT,
+    confidence REAL,
+    moved      INTEGER NOT NULL DEFAULT 0,
+    extra      TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS features (
+    id   TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    account    TEXT PRIMARY KEY,
+    history_id TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+_CORE_FIELDS = ("id", "subject", "label", "confidence", "moved")
+
+# SQLite caps the number of bound parameters per statement.
+_MAX_VARS = 900
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class MessageStore:
+    """
+    One SQLite connection shared by every thread that uses the store; each
+    statement and transaction holds `_lock`, so threads never interleave
+    statements on it or commit each other's half-written batches.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WAL keeps readers unblocked during writes and makes each commit atomic.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ── Processed IDs ──────────────────────────────────────────────────────────
+    def is_processed(self, msg_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM processed WHERE id = ?", (msg_id,)).fetchone()
+        return row is not None
+
+    def filter_unprocessed(self, msg_ids: list) -> list:
+        """Return the IDs from `msg_ids` not yet processed, preserving order."""
+        msg_ids = list(msg_ids)
+        seen = set()
+        for chunk in _chunks(msg_ids, _MAX_VARS):
+            marks = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(f"SELECT id FROM processed WHERE id IN ({marks})", chunk).fetchall()
+            seen.update(r["id"] for r in rows)
+        return [m for m in msg_ids if m not in seen]
+
+    def mark_processed(self, msg_ids):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed (id) VALUES (?)", ((m,) for m in msg_ids)
+            )
+
+    def processed_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+
+    # ── Classifications ────────────────────────────────────────────────────────
+    def upsert_classifications(self, records: list, mark_processed: bool = True):
+        """
+        Insert or replace classification results and (by default) mark their IDs
+        processed, all in one transaction. Fields beyond the core columns go
+        into `extra`.
+        """
+        rows = []
+        for r in records:
+            extra = {k: v for k, v in r.items() if k not in _CORE_FIELDS}
+            rows.append((
+                r["id"], r.get("subject"), r.get("label"), r.get("confidence"),
+                int(bool(r.get("moved"))), json.dumps(extra) if extra else None,
+            ))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO classifications (id, subject, label, confidence, moved, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET subject = excluded.subject, label = excluded.label, "
+                "confidence = excluded.confidence, moved = excluded.moved, extra = excluded.extra",
+                rows,
+            )
+            if mark_processed:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed (id) VALUES (?)", ((row[0],) for row in rows)
+                )
+
+    def set_moved(self, msg_ids, moved: bool = True):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE classifications SET moved = ? WHERE id = ?",
+                ((int(moved), m) for m in msg_ids),
+            )
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        record = {k: row[k] for k in _CORE_FIELDS}
+        record["moved"] = bool(record["moved"])
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+        return record
+
+    def get_classification(self, msg_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM classifications WHERE id = ?", (msg_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def iter_classifications(self, batch_size: int = 1000):
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT * FROM classifications WHERE id > ? ORDER BY id LIMIT ?", (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1]["id"]
+            for row in rows:
+                yield self._row_to_dict(row)
+
+    def update_labels(self, rows):
+        """Set (label, confidence) for existing classifications; rows are (id, label, confidence)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE classifications SET label = ?, confidence = ? WHERE id = ?",
+                ((label, confidence, msg_id) for msg_id, label, confidence in rows),
+            )
+
+    # ── Feature Records ────────────────────────────────────────────────────────
+    def upsert_features(self, records: dict):
+        """Store scorer.extract_features() records, keyed by message ID."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO features (id, data) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                ((msg_id, json.dumps(f, ensure_ascii=False)) for msg_id, f in records.items()),
+            )
+
+    def get_features(self, msg_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM features WHERE id = ?", (msg_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def iter_features(self, batch_size: int = 1000):
+        """
+        Yield {id: record} batches of stored feature records. Each batch is its
+        own query, so callers can write to the store between batches.
+        """
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, data FROM features WHERE id > ? ORDER BY id LIMIT ?", (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1]["id"]
+            yield {r["id"]: json.loads(r["data"]) for r in rows}
+
+    # ── Sync State ─────────────────────────────────────────────────────────────
+    def get_history_id(self, account: str = "me"):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_id FROM sync_state WHERE account = ?", (account,)
+            ).fetchone()
+        return row["history_id"] if row else None
+
+    def set_history_id(self, account: str, history_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (account, history_id) VALUES (?, ?) "
+                "ON CONFLICT(account) DO UPDATE SET history_id = excluded.history_id",
+                (account, str(history_id)),
+            )
+
+    # ── Migration ──────────────────────────────────────────────────────────────
+    def import_legacy(self, ids_path: str = "processed_ids.json",
+                      classified_path: str = "classified_emails.json") -> dict:
+        """Load the old JSON files into the store. Safe to run more than once."""
+        counts = {"processed": 0, "classifications": 0}
+        if os.path.exists(ids_path):
+            with open(ids_path, encoding="utf-8") as f:
+                ids = json.load(f)
+            self.mark_processed(ids)
+            counts["processed"] = len(ids)
+        if os.path.exists(classified_path):
+            with open(classified_path, encoding="utf-8") as f:
+                records = json.load(f)
+            self.upsert_classifications(records, mark_processed=False)
+            counts["classifications"] = len(records)
+        return counts
+
+
+def rescore(store: MessageStore, hybrid: bool = False) -> int:
+    """
+    Re-score every stored feature record and update the stored labels. No
+    text is re-processed; regexes run only for records whose signals predate
+    the current PATTERNS, and those records are saved with fresh signals.
+    """
+    from scorer import PATTERNS_VERSION, score_records
+
+    count = 0
+    for batch in store.iter_features():
+        records = list(batch.values())
+        stale = {i: f for i, f in batch.items() if f.get("patterns_version") != PATTERNS_VERSION}
+        results = score_records(records, hybrid=hybrid)
+        store.update_labels((i, r["label"], r["confidence"]) for i, r in zip(batch, results))
+        if stale:
+            store.upsert_features(stale)
+        count += len(records)
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "rescore"):
+        print(__doc__)
+        sys.exit(1)
+    with MessageStore(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DB_PATH) as store:
+        if sys.argv[1] == "migrate":
+            print(store.import_legacy())
+        else:
+            print(f"Re-scored {rescore(store)} messages")
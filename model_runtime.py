@@ -0,0 +1,298 @@
+"""
+InboxAI — Model Runtime
+NumPy-only inference for the subject classifier trained by train.py.
+
+The TF-IDF vocabulary (sorted), IDF weights, coefficients and intercepts are
+stored as raw .npy files and loaded with mmap_mode="r", so every worker maps
+the same pages and starts without importing sklearn or unpickling anything.
+Predictions match the pickled TfidfVectorizer + LogisticRegression.
+Models from the online trainer (HashingVectorizer + SGDClassifier) export
+without a vocabulary; tokens are hashed with MurmurHash3 like sklearn does.
+
+Exports are written to a fresh versioned subdirectory of `model/` and
+published by atomically replacing the `model/CURRENT` pointer file with its
+name (os.replace), so a worker loading the model sees either the old arrays
+or the new ones, never a mix. `model/` stays a plain directory that can be
+committed as is; without CURRENT its top-level arrays are loaded. load_model()
+notices the new pointer and reloads.
+
+Usage: python model_runtime.py export [--vectorizer vectorizer.pkl] [--model model.pkl] [--out model]
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+
+import numpy as np
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+ARRAYS = ("vocab", "idf", "coef", "intercept", "classes")
+CURRENT = "CURRENT"
+_VERSION_RE = re.compile(r"v\d{14}-")
+MASK32 = 0xFFFFFFFF
+
+
+def _rotl32(x: int, r: int) -> int:
+    return ((x << r) | (x >> (32 - r))) & MASK32
+
+
+def murmurhash3_32(data: bytes, seed: int = 0) -> int:
+    """Signed 32-bit MurmurHash3 (x86), as sklearn.utils.murmurhash3_32."""
+    c1, c2 = 0xCC9E2D51, 0x1B873593
+    h = seed & MASK32
+    end = len(data) & ~3
+    for i in range(0, end, 4):
+        k = _rotl32((int.from_bytes(data[i:i + 4], "little") * c1) & MASK32, 15)
+        h = _rotl32(h ^ ((k * c2) & MASK32), 13)
+        h = (h * 5 + 0xE6546B64) & MASK32
+    tail = data[end:]
+    if tail:
+        k = int.from_bytes(tail, "little")
+        h ^= (_rotl32((k * c1) & MASK32, 15) * c2) & MASK32
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & MASK32
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & MASK32
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+# ── Export ─────────────────────────────────────────────────────────────────────
+def _current_version(model_dir: str):
+    """Name of the published version under `model_dir`, or None for a flat export."""
+    try:
+        with open(os.path.join(model_dir, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_model_dir(model_dir: str = MODEL_DIR) -> str:
+    """Directory holding the arrays of the version `model_dir/CURRENT` points at."""
+    version = _current_version(model_dir)
+    return os.path.join(model_dir, version) if version else model_dir
+
+
+def _publish(out_dir: str, arrays: dict, meta: dict):
+    """
+    Write `arrays` and meta.json into a new versioned subdirectory of
+    `out_dir`, then point `out_dir/CURRENT` at it with one os.replace. The
+    previous version is kept for readers still opening it; older ones are
+    removed.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    previous = _current_version(out_dir)
+    version_dir = tempfile.mkdtemp(prefix=time.strftime("v%Y%m%d%H%M%S-"), dir=out_dir)
+    os.chmod(version_dir, 0o755)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(version_dir, f"{array_name}.npy"), array, allow_pickle=False)
+    with open(os.path.join(version_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    version = os.path.basename(version_dir)
+    fd, pointer = tempfile.mkstemp(prefix=f".{CURRENT}-", dir=out_dir)
+    with os.fdopen(fd, "w") as f:
+        f.write(version + "\n")
+    os.chmod(pointer, 0o644)
+    os.replace(pointer, os.path.join(out_dir, CURRENT))
+
+    for entry in os.scandir(out_dir):
+        if entry.is_dir(follow_symlinks=False) and _VERSION_RE.match(entry.name) and entry.name not in (version, previous):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def export_model(vectorizer, model, out_dir: str = MODEL_DIR):
+    """
+    Write a fitted TfidfVectorizer + linear classifier as .npy arrays plus a
+    small meta.json. Raises ValueError for vectorizer options the runtime
+    does not reproduce.
+    """
+    params = vectorizer.get_params()
+    unsupported = {
+        "analyzer": "word", "ngram_range": (1, 1), "preprocessor": None,
+        "tokenizer": None, "strip_accents": None,
+    }
+    for name, expected in unsupported.items():
+        if params[name] != expected:
+            raise ValueError(f"export_model: {name}={params[name]!r} is not supported")
+
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    order = np.argsort(np.array(terms))
+    vocab = np.array(terms)[order]
+    idf = vectorizer.idf_[order] if params["use_idf"] else np.ones(len(terms))
+    coef = np.asarray(model.coef_, dtype=np.float64)[:, order]
+
+    arrays = {
+        "vocab": vocab,
+        "idf": np.asarray(idf, dtype=np.float64),
+        "coef": np.ascontiguousarray(coef),
+        "intercept": np.asarray(model.intercept_, dtype=np.float64),
+        "classes": np.asarray(model.classes_).astype(str),
+    }
+    meta = {
+        "token_pattern": params["token_pattern"],
+        "lowercase": params["lowercase"],
+        "binary": params["binary"],
+        "sublinear_tf": params["sublinear_tf"],
+        "norm": params["norm"],
+    }
+    _publish(out_dir, arrays, meta)
+
+
+def export_hashed_model(vectorizer, model, out_dir: str = MODEL_DIR):
+    """Write a HashingVectorizer + linear classifier; no vocabulary is stored."""
+    params = vectorizer.get_params()
+    expected = {
+        "analyzer": "word", "ngram_range": (1, 1), "preprocessor": None,
+        "tokenizer": None, "strip_accents": None, "alternate_sign": False,
+    }
+    for name, value in expected.items():
+        if params[name] != value:
+            raise ValueError(f"export_hashed_model: {name}={params[name]!r} is not supported")
+
+    arrays = {
+        "coef": np.ascontiguousarray(model.coef_, dtype=np.float64),
+        "intercept": np.asarray(model.intercept_, dtype=np.float64),
+        "classes": np.asarray(model.classes_).astype(str),
+    }
+    meta = {
+        "token_pattern": params["token_pattern"],
+        "lowercase": params["lowercase"],
+        "binary": params["binary"],
+        "sublinear_tf": False,
+        "norm": params["norm"],
+        "n_features": params["n_features"],
+    }
+    _publish(out_dir, arrays, meta)
+
+
+# ── Inference ──────────────────────────────────────────────────────────────────
+class TextModel:
+    def __init__(self, path: str = MODEL_DIR, mmap: bool = True):
+        mode = "r" if mmap else None
+        # Resolve CURRENT once so every file comes from the same export.
+        path = resolve_model_dir(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.n_features = self.meta.get("n_features")
+        for name in ARRAYS:
+            if self.n_features and name in ("vocab", "idf"):
+                setattr(self, name, None)
+                continue
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode, allow_pickle=False))
+        self._token_re = re.compile(self.meta["token_pattern"])
+        if self.n_features:
+            n_features = self.n_features
+            self._hash_column = lru_cache(maxsize=100_000)(
+                lambda token: abs(murmurhash3_32(token.encode("utf-8"))) % n_features)
+
+    def _tokens(self, text) -> list:
+        text = text or ""
+        if self.meta["lowercase"]:
+            text = text.lower()
+        return self._token_re.findall(text)
+
+    def transform(self, texts, tokenized: bool = False):
+        """
+        TF-IDF features as COO triples (rows, cols, values) over the sorted
+        vocabulary (or hashed columns), normalised per row like sklearn.
+        With `tokenized`, each text is already a list of lowercased tokens.
+        """
+        doc_ids, tokens = [], []
+        for i, text in enumerate(texts):
+            toks = text if tokenized else self._tokens(text)
+            tokens += toks
+            doc_ids += [i] * len(toks)
+        if not tokens:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        if self.n_features:
+            width = self.n_features
+            cols = np.fromiter((self._hash_column(t) for t in tokens), dtype=np.int64, count=len(tokens))
+        else:
+            width = len(self.vocab)
+            tokens = np.array(tokens)
+            cols = np.searchsorted(self.vocab, tokens)
+            cols[cols == width] = 0
+            known = self.vocab[cols] == tokens
+            doc_ids, cols = doc_ids[known], cols[known]
+        pairs, counts = np.unique(doc_ids * width + cols, return_counts=True)
+        rows, cols = np.divmod(pairs, width)
+
+        tf = counts.astype(np.float64)
+        if self.meta["binary"]:
+            tf[:] = 1.0
+        elif self.meta["sublinear_tf"]:
+            tf = np.log(tf) + 1.0
+        values = tf if self.idf is None else tf * self.idf[cols]
+        if self.meta["norm"] == "l2":
+            norms = np.sqrt(np.bincount(rows, weights=values * values))
+            values = values / norms[rows]
+        elif self.meta["norm"] == "l1":
+            values = values / np.bincount(rows, weights=np.abs(values))[rows]
+        return rows, cols, values
+
+    def decision_function(self, texts, tokenized: bool = False):
+        texts = list(texts)
+        rows, cols, values = self.transform(texts, tokenized)
+        scores = np.empty((len(texts), len(self.coef)))
+        for k, (coef, intercept) in enumerate(zip(self.coef, self.intercept)):
+            scores[:, k] = np.bincount(rows, weights=values * coef[cols], minlength=len(texts)) + intercept
+        return scores[:, 0] if len(self.coef) == 1 else scores
+
+    def predict_proba(self, texts, tokenized: bool = False):
+        scores = self.decision_function(texts, tokenized)
+        if scores.ndim == 1:
+            positive = 1.0 / (1.0 + np.exp(-scores))
+            return np.column_stack([1.0 - positive, positive])
+        exp = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, texts, tokenized: bool = False):
+        scores = self.decision_function(texts, tokenized)
+        if scores.ndim == 1:
+            return self.classes[(scores > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+
+_model = None
+_model_key = None
+
+def load_model(path: str = MODEL_DIR) -> TextModel:
+    """Process-wide model, mapped on first use and reloaded once an export replaces CURRENT."""
+    global _model, _model_key
+    try:
+        marker = os.stat(os.path.join(path, CURRENT))
+    except FileNotFoundError:
+        marker = os.stat(os.path.join(path, "meta.json"))
+    key = (os.path.abspath(path), marker.st_ino, marker.st_mtime_ns)
+    if _model is None or key != _model_key:
+        _model = TextModel(path)
+        _model_key = key
+    return _model
+
+
+if __name__ == "__main__":
+    import argparse
+    import pickle
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--vectorizer", default="vectorizer.pkl")
+    parser.add_argument("--model", default="model.pkl")
+    parser.add_argument("--out", default=MODEL_DIR)
+    args = parser.parse_args()
+
+    with open(args.vectorizer, "rb") as f:
+        vectorizer = pickle.load(f)
+    with open(args.model, "rb") as f:
+        model = pickle.load(f)
+    export_model(vectorizer, model, args.out)
+    print(f"✅ Exported {len(vectorizer.vocabulary_)}-term model to {args.out}")
@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import json
@@ -16,6 +17,283 @@ os.environ['SUPABASE_URL'] = 'http://localhost'
 os.environ['SUPABASE_KEY'] = 'prod-key'
 
 from backend_flask import app, create_backend_token, verify_backend_token
+import backend_flask
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from supabase_client import SupabaseError, _merge_counts
+
+
+def _matches(value, condition: str) -> bool:
+    """PostgREST `eq.`, `lt.`, `gt.` and `is.null` filters, as far as the client uses them."""
+    op, _, operand = condition.partition(".")
+    if op == "is":
+        return value is None
+    if value is None:
+        return False
+    text = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    if op == "eq":
+        return text == operand
+    return text < operand if op == "lt" else text > operand
+
+class StubSupabase:
+    """Minimal local stand-in for the Supabase `users` REST table."""
+
+    def __init__(self):
+        self.users = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                length = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(length)) if length else None
+                stub.requests.append((self.command, url.path))
+                email_filter = query.get("email", ["eq."])[0]
+                if email_filter.startswith("in.("):
+                    emails = [e.strip('"') for e in email_filter[4:-1].split(",")]
+                else:
+                    emails = [email_filter[3:]]
+                email = emails[0]
+                if self.command == "GET":
+                    return self._reply(200, [stub.users[e] for e in emails if e in stub.users])
+                if url.path == "/rest/v1/rpc/increment_scan":
+                    with stub.lock:
+                        row = stub.users.get(data["p_email"])
+                        limit = data.get("p_limit")
+                        current = row.get("scans_today", 0) if row and row.get("last_reset_date") == data["p_day"] else 0
+                        if not row:
+                            return self._reply(200, -1)
+                        if limit is not None and current >= limit:
+                            return self._reply(200, None)
+                        row.update(scans_today=current + 1, last_reset_date=data["p_day"])
+                        return self._reply(200, row["scans_today"])
+                if url.path == "/rest/v1/rpc/merge_analytics":
+                    with stub.lock:
+                        row = stub.users.get(data["p_email"])
+                        if not row:
+                            return self._reply(200, None)
+                        row["analytics"] = _merge_counts(row.get("analytics"), data["p_delta"])
+                        return self._reply(200, row["analytics"])
+                if self.command == "POST":
+                    row = stub.users.setdefault(data["email"], {})
+                    row.update(data)
+                    return self._reply(201, [row])
+                if self.command == "PATCH":
+                    with stub.lock:
+                        rows = [stub.users[e] for e in emails if e in stub.users]
+                        rows = [r for r in rows if all(_matches(r.get(k), v[0]) for k, v in query.items()
+                                                       if k not in ("email", "select"))]
+                        for row in rows:
+                            row.update(data)
+                        return self._reply(200, rows)
+                self._reply(404, {})
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, method):
+        return sum(1 for m, _ in self.requests if m == method)
+
+    def close(self):
+        self.server.shutdown()
+
+class StubLLM:
+    """Local stand-in for the OpenAI chat completions endpoint."""
+
+    def __init__(self, delay=0.0):
+        self.calls = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = body["messages"][0]["content"]
+                stub.calls.append(prompt)
+                time.sleep(delay)
+                if "JSON array" in prompt:
+                    count = int(prompt.split("JSON array of ")[1].split()[0])
+                    content = json.dumps([f"batched {i}" for i in range(count)])
+                else:
+                    content = "Looks like a promotion."
+                payload = json.dumps({
+                    "id": "x", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+def _http_error(status, reason=""):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    body = json.dumps({"error": {"code": status, "message": reason}}).encode()
+    return HttpError(httplib2.Response({"status": status}), body)
+
+class FakeGmail:
+    """
+    In-memory stand-in for the googleapiclient Gmail service. Every call is
+    logged in `calls`; queue HTTP statuses in `errors[name]` (e.g.
+    errors["batch"] = [429]) to make the next calls of that name fail.
+    """
+
+    def __init__(self, n=0):
+        self.mail = {
+            f"m{i:04d}": {"id": f"m{i:04d}", "threadId": "t", "snippet": f"snippet {i}", "labelIds": ["INBOX"],
+                          "payload": {"headers": [{"name": "Subject", "value": f"Sale {i}"},
+                                                  {"name": "From", "value": "deals@shop.io"}]}}
+            for i in range(n)
+        }
+        self.label_list = [{"id": "INBOX", "name": "INBOX"}]
+        self.history_records = []
+        self.history_id = 1000
+        self.oldest_history_id = 0
+        self.calls = []
+        self.batches = []
+        self.errors = {}
+
+    class _Call:
+        def __init__(self, gmail, name, kwargs):
+            self.gmail, self.name, self.kwargs = gmail, name, kwargs
+
+        def execute(self, num_retries=0):
+            self.gmail.calls.append((self.name, self.kwargs))
+            if self.gmail.errors.get(self.name):
+                raise _http_error(self.gmail.errors[self.name].pop(0))
+            return getattr(self.gmail, "_" + self.name.replace(".", "_"))(**self.kwargs)
+
+    class _Resource:
+        def __init__(self, gmail, name):
+            self.gmail, self.name = gmail, name
+
+        def __getattr__(self, method):
+            return lambda **kwargs: FakeGmail._Call(self.gmail, f"{self.name}.{method}", kwargs)
+
+    class _Batch:
+        def __init__(self, gmail, callback):
+            self.gmail, self.callback, self.items = gmail, callback, []
+
+        def add(self, call, request_id):
+            self.items.append((call, request_id))
+
+        def execute(self):
+            self.gmail.batches.append(len(self.items))
+            if self.gmail.errors.get("batch"):
+                raise _http_error(self.gmail.errors["batch"].pop(0))
+            for call, request_id in self.items:
+                try:
+                    self.callback(request_id, call.execute(), None)
+                except Exception as e:
+                    self.callback(request_id, None, e)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self._Resource(self, "messages")
+
+    def labels(self):
+        return self._Resource(self, "labels")
+
+    def history(self):
+        return self._Resource(self, "history")
+
+    def getProfile(self, **kwargs):
+        return self._Call(self, "users.getProfile", kwargs)
+
+    def deliver(self, msg_id, label_ids=("INBOX",)):
+        """Add a new message and the history record Gmail would write for it."""
+        self.mail[msg_id] = {"id": msg_id, "threadId": "t", "snippet": "", "labelIds": list(label_ids),
+                             "payload": {"headers": [{"name": "Subject", "value": msg_id}]}}
+        self.history_id += 1
+        self.history_records.append({"id": str(self.history_id),
+                             "messagesAdded": [{"message": {"id": msg_id, "labelIds": list(label_ids)}}]})
+
+    def new_batch_http_request(self, callback):
+        return self._Batch(self, callback)
+
+    def count(self, name):
+        return sum(1 for n, _ in self.calls if n == name)
+
+    def _messages_list(self, userId, maxResults, q=None, labelIds=None, pageToken=None):
+        ids = sorted(m for m, msg in self.mail.items()
+                     if not labelIds or set(labelIds) <= set(msg["labelIds"]))
+        start = int(pageToken or 0)
+        resp = {"messages": [{"id": m} for m in ids[start:start + maxResults]]}
+        if start + maxResults < len(ids):
+            resp["nextPageToken"] = str(start + maxResults)
+        return resp
+
+    def _messages_get(self, userId, id, format, metadataHeaders):
+        if id not in self.mail:
+            raise _http_error(404, "Not Found")
+        return self.mail[id]
+
+    def _messages_modify(self, userId, id, body):
+        return self._messages_batchModify(userId, {"ids": [id], **body})
+
+    def _messages_batchModify(self, userId, body):
+        assert len(body["ids"]) <= 1000
+        known = {l["id"] for l in self.label_list}
+        if not set(body["addLabelIds"]) <= known:
+            raise _http_error(400, "Invalid label")
+        for msg_id in body["ids"]:
+            msg = self.mail[msg_id]
+            msg["labelIds"] = [l for l in msg["labelIds"] if l not in body["removeLabelIds"]] + body["addLabelIds"]
+
+    def _users_getProfile(self, userId):
+        return {"emailAddress": "me@example.com", "historyId": str(self.history_id)}
+
+    def _history_list(self, userId, startHistoryId, historyTypes, labelId, maxResults, pageToken=None):
+        if int(startHistoryId) < self.oldest_history_id:
+            raise _http_error(404, "Requested entity was not found.")
+        records = [h for h in self.history_records if int(h["id"]) > int(startHistoryId)]
+        start, size = int(pageToken or 0), 2
+        resp = {"history": records[start:start + size], "historyId": str(self.history_id)}
+        if start + size < len(records):
+            resp["nextPageToken"] = str(start + size)
+        return resp
+
+    def _labels_list(self, userId):
+        return {"labels": [dict(l) for l in self.label_list]}
+
+    def _labels_create(self, userId, body):
+        if any(l["name"].lower() == body["name"].lower() for l in self.label_list):
+            raise _http_error(409, "Label name exists or conflicts")
+        label = {"id": f"Label_{len(self.label_list)}", "name": body["name"]}
+        self.label_list.append(label)
+        return label
 
 def test_jwt_authentication():
     print("Testing JWT Authentication...")
@@ -43,7 +321,8 @@ def test_usage_tracking():
     token = create_backend_token(email)
     
     with app.test_client() as client:
-        with patch('backend_flask.get_user') as mock_get:
+        with patch('backend_flask.get_user') as mock_get, \
+             patch.object(backend_flask.supabase, 'increment_scan', return_value=101) as mock_increment:
             with patch('backend_flask.update_user') as mock_update:
                 # Mock free user at limit
                 mock_get.return_value = {
@@ -64,9 +343,23 @@ def test_usage_tracking():
                     "last_reset_date": str(date.today())
                 }
                 resp = client.post('/usage/increment-scan', headers={"Authorization": f"Bearer {token}"})
-                assert resp.status_code == 200
+                assert resp.status_code == 200 and resp.get_json()["scans_today"] == 101
+                assert mock_increment.call_args[0][1] is None
                 print("  ✅ Unlimited scans allowed for premium users.")
 
+                # Counter unreachable: free scans fail closed, premium scans go through
+                mock_increment.side_effect = SupabaseError("POST rpc/increment_scan timed out")
+                resp = client.post('/usage/increment-scan', headers={"Authorization": f"Bearer {token}"})
+                assert resp.status_code == 200
+                mock_get.return_value = {"email": email, "is_premium": False, "scans_today": 1,
+                                         "last_reset_date": str(date.today())}
+                resp = client.post('/usage/increment-scan', headers={"Authorization": f"Bearer {token}"})
+                assert resp.status_code == 503
+                with patch.object(backend_flask.supabase, 'key', None):
+                    resp = client.post('/usage/increment-scan', headers={"Authorization": f"Bearer {token}"})
+                    assert resp.status_code == 503
+                print("  ✅ Free-tier scans fail closed when the counter is unavailable.")
+
 def test_cleanup_validation():
     print("\nTesting Cleanup Validation...")
     email = "free@example.com"
@@ -90,11 +383,1105 @@ def test_cleanup_validation():
             assert resp.status_code == 200
             print("  ✅ Unlimited cleanup allowed for premium users.")
 
+def test_analytics_aggregate():
+    print("\nTesting Running Analytics Aggregate...")
+    email = "stats@example.com"
+    token = create_backend_token(email)
+    headers = {"Authorization": f"Bearer {token}"}
+    stub = StubSupabase()
+    stub.users[email] = {"email": email, "is_premium": False}
+
+    try:
+        with patch.object(backend_flask.supabase, 'url', stub.url), app.test_client() as client:
+            partial = {"total": 4, "categories": {"Promotion": 3, "Phishing Risk": 1},
+                       "phishing_count": 1, "archiveable": 4}
+            client.post('/analytics', headers=headers, json=partial)
+            resp = client.post('/analytics', headers=headers, json=partial)
+            assert resp.status_code == 200
+            snap = client.get('/analytics', headers=headers).get_json()
+            assert snap["total"] == 8
+            assert snap["categories"] == {"Promotion": 6, "Phishing Risk": 2}
+            assert snap["clutter_score"] == 100
+            assert stub.users[email]["analytics"]["total"] == 8
+            assert backend_flask._local_analytics == {}
+            print("  ✅ Partial aggregates merge into the shared per-user row.")
+
+            bad = [
+                {**partial, "total": -4},
+                {**partial, "total": 5},
+                {**partial, "phishing_count": 0},
+                {**partial, "archiveable": 9},
+                {**partial, "categories": {"Promotion": "3", "Phishing Risk": 1}},
+                [partial],
+            ]
+            for payload in bad:
+                assert client.post('/analytics', headers=headers, json=payload).status_code == 400, payload
+            assert stub.users[email]["analytics"]["total"] == 8
+            print("  ✅ Negative or inconsistent snapshots are rejected.")
+    finally:
+        stub.close()
+
+def test_user_cache():
+    print("\nTesting User Record Cache...")
+    email = "cached@example.com"
+    token = create_backend_token(email)
+    headers = {"Authorization": f"Bearer {token}"}
+    stub = StubSupabase()
+    stub.users[email] = {"email": email, "is_premium": False, "scans_today": 1,
+                         "last_reset_date": str(date.today())}
+    backend_flask.user_cache.clear()
+
+    try:
+        with patch.object(backend_flask.supabase, 'url', stub.url), app.test_client() as client:
+            client.get('/whoami', headers=headers)
+            resp = client.get('/whoami', headers=headers)
+            assert resp.get_json()["scans_today"] == 1
+            assert stub.count("GET") == 1
+            print("  ✅ Repeated reads are served from the cache.")
+
+            client.post('/usage/increment-scan', headers=headers)
+            resp = client.get('/whoami', headers=headers)
+            assert resp.get_json()["scans_today"] == 2
+            assert stub.count("GET") == 1
+            print("  ✅ Writes refresh the cached record.")
+    finally:
+        stub.close()
+        backend_flask.user_cache.clear()
+
+def test_supabase_bulk():
+    print("\nTesting Supabase Bulk Operations...")
+    from supabase_client import SupabaseClient
+    stub = StubSupabase()
+    for i in range(5):
+        stub.users[f"u{i}@example.com"] = {"email": f"u{i}@example.com", "scans_today": i}
+    client = SupabaseClient(stub.url, "key")
+
+    try:
+        rows = client.get_users([f"u{i}@example.com" for i in range(3)] + ["missing@example.com"])
+        assert sorted(r["email"] for r in rows) == [f"u{i}@example.com" for i in range(3)]
+        assert stub.count("GET") == 1
+        print("  ✅ Many users fetched in one in.(...) query.")
+
+        rows = client.update_users([f"u{i}@example.com" for i in range(5)], {"scans_today": 0})
+        assert len(rows) == 5 and all(u["scans_today"] == 0 for u in stub.users.values())
+        assert stub.count("PATCH") == 1
+        print("  ✅ Bulk update applied in one request.")
+    finally:
+        stub.close()
+
+def test_atomic_scan_counter():
+    print("\nTesting Atomic Scan Counter...")
+    email = "racer@example.com"
+    token = create_backend_token(email)
+    headers = {"Authorization": f"Bearer {token}"}
+    stub = StubSupabase()
+    stub.users[email] = {"email": email, "is_premium": False, "scans_today": 0,
+                         "last_reset_date": str(date.today())}
+    backend_flask.user_cache.clear()
+    statuses = []
+
+    def scan():
+        with app.test_client() as client:
+            statuses.append(client.post('/usage/increment-scan', headers=headers).status_code)
+
+    try:
+        with patch.object(backend_flask.supabase, 'url', stub.url):
+            backend_flask.get_user(email)  # every request sees the same cached count
+            threads = [threading.Thread(target=scan) for _ in range(20)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+        assert statuses.count(200) == 5 and statuses.count(429) == 15
+        assert stub.users[email]["scans_today"] == 5
+        assert stub.count("PATCH") == 0
+        print("  ✅ Concurrent scans never exceed the free-tier limit.")
+
+        # The row vanishes after the user was cached: not a limit, so 503 rather than 429.
+        for premium in (False, True):
+            backend_flask.user_cache.clear()
+            ghost = f"ghost{int(premium)}@example.com"
+            stub.users[ghost] = {"email": ghost, "is_premium": premium, "scans_today": 0,
+                                 "last_reset_date": str(date.today())}
+            with patch.object(backend_flask.supabase, 'url', stub.url), app.test_client() as client:
+                backend_flask.get_user(ghost)
+                del stub.users[ghost]
+                resp = client.post('/usage/increment-scan',
+                                   headers={"Authorization": f"Bearer {create_backend_token(ghost)}"})
+            assert resp.status_code == 503, resp.status_code
+        print("  ✅ A missing users row is reported as 503, not as a reached limit.")
+    finally:
+        stub.close()
+        backend_flask.user_cache.clear()
+
+def test_lazy_daily_reset():
+    print("\nTesting Lazy Daily Quota Reset...")
+    email = "yesterday@example.com"
+    token = create_backend_token(email)
+    headers = {"Authorization": f"Bearer {token}"}
+    stub = StubSupabase()
+    stub.users[email] = {"email": email, "is_premium": False, "scans_today": 5,
+                         "last_reset_date": "2000-01-01"}
+    backend_flask.user_cache.clear()
+
+    try:
+        with patch.object(backend_flask.supabase, 'url', stub.url), app.test_client() as client:
+            resp = client.get('/whoami', headers=headers)
+            assert resp.get_json()["scans_today"] == 0
+            assert stub.count("PATCH") == 0
+            print("  ✅ Yesterday's count reads as zero without a reset write.")
+
+            resp = client.post('/usage/increment-scan', headers=headers)
+            assert resp.status_code == 200 and resp.get_json()["scans_today"] == 1
+            assert stub.users[email]["last_reset_date"] == str(date.today())
+            print("  ✅ First scan of the day starts a fresh count.")
+    finally:
+        stub.close()
+        backend_flask.user_cache.clear()
+
+def test_google_token_cache():
+    print("\nTesting Google Token Verification Cache...")
+    verifier = backend_flask.google_verifier
+    verifier.results.clear()
+    tokeninfo = MagicMock(status_code=200)
+    tokeninfo.json.return_value = {"email": "login@example.com", "expires_in": "3599"}
+
+    stub = StubSupabase()
+    backend_flask.user_cache.clear()
+
+    try:
+        with patch.object(verifier.session, 'get', return_value=tokeninfo) as mock_get, \
+             patch('token_verifier.id_token.verify_oauth2_token') as mock_id_token, \
+             patch.object(backend_flask.supabase, 'url', stub.url):
+            with app.test_client() as client:
+                for _ in range(3):
+                    resp = client.post('/auth/verify-google', json={"id_token": "ya29.access-token"})
+                    assert resp.get_json()["email"] == "login@example.com"
+            assert mock_get.call_count == 1
+            assert mock_id_token.call_count == 0
+            assert "login@example.com" in stub.users
+            print("  ✅ Access tokens verified once, then served from cache.")
+    finally:
+        stub.close()
+        verifier.results.clear()
+        backend_flask.user_cache.clear()
+
+def test_refresh_tokens():
+    print("\nTesting Refresh Tokens & Token Cache...")
+    import jwt
+    from backend_flask import create_refresh_token
+    email = "refresh@example.com"
+    assert verify_backend_token(create_refresh_token(email, "x")) is None
+    print("  ✅ Refresh tokens are rejected as access tokens.")
+
+    stub = StubSupabase()
+    stub.users[email] = {"email": email, "is_premium": False}
+    try:
+        with patch.object(backend_flask.supabase, 'url', stub.url), app.test_client() as client, \
+             patch('backend_flask.verify_google_token', return_value=email):
+            login = client.post('/auth/verify-google', json={"id_token": "google"}).get_json()
+            refresh = login["refresh_token"]
+            assert stub.users[email]["refresh_jti"] == jwt.decode(refresh, options={"verify_signature": False})["jti"]
+            resp = client.post('/auth/refresh', json={"refresh_token": refresh})
+            assert resp.status_code == 200
+            access = resp.get_json()["token"]
+            rotated = resp.get_json()["refresh_token"]
+            assert verify_backend_token(access) == email
+            resp = client.post('/auth/refresh', json={"refresh_token": access})
+            assert resp.status_code == 401
+            print("  ✅ Refresh token exchanged for a new access token.")
+
+            with patch('backend_flask.jwt.decode') as mock_decode:
+                assert verify_backend_token(access) == email
+                assert mock_decode.call_count == 0
+            print("  ✅ Recently verified tokens skip jwt.decode.")
+
+            claims = [jwt.decode(t, options={"verify_signature": False}) for t in (refresh, rotated)]
+            assert claims[0]["jti"] != claims[1]["jti"] and claims[0]["exp"] == claims[1]["exp"]
+            resp = client.post('/auth/refresh', json={"refresh_token": rotated})
+            assert resp.status_code == 200
+            latest = resp.get_json()["refresh_token"]
+            print("  ✅ Each refresh rotates the jti and keeps the session's fixed expiry.")
+
+            assert client.post('/auth/refresh', json={"refresh_token": refresh}).status_code == 401
+            assert stub.users[email]["refresh_jti"] is None
+            assert client.post('/auth/refresh', json={"refresh_token": latest}).status_code == 401
+            print("  ✅ Reusing a rotated refresh token revokes the whole session.")
+
+            refresh = client.post('/auth/verify-google', json={"id_token": "google"}).get_json()["refresh_token"]
+            resp = client.post('/logout', headers={"Authorization": f"Bearer {access}"},
+                               json={"refresh_token": refresh})
+            assert resp.status_code == 200 and stub.users[email]["refresh_jti"] is None
+            assert client.post('/auth/refresh', json={"refresh_token": refresh}).status_code == 401
+            print("  ✅ Logout revokes the live refresh token.")
+
+            refresh = client.post('/auth/verify-google', json={"id_token": "google"}).get_json()["refresh_token"]
+            assert client.post('/logout', json={"refresh_token": refresh}).status_code == 200
+            assert stub.users[email]["refresh_jti"] is None
+            refresh = client.post('/auth/verify-google', json={"id_token": "google"}).get_json()["refresh_token"]
+            with patch.object(backend_flask.supabase, 'request', side_effect=SupabaseError("down")):
+                assert client.post('/auth/refresh', json={"refresh_token": refresh}).status_code == 503
+                assert backend_flask.verify_refresh_token(refresh) is None
+            print("  ✅ Logout works with the refresh token alone; DB errors fail closed.")
+    finally:
+        stub.close()
+        backend_flask.user_cache.clear()
+
+def test_classify_batch():
+    print("\nTesting Server-Side Batch Classification...")
+    import gzip
+    email = "classify@example.com"
+    token = create_backend_token(email)
+    headers = {"Authorization": f"Bearer {token}"}
+    emails = [
+        {"id": "1", "subject": "Flash sale today only", "from": "deals@shop.io", "snippet": ""},
+        {"id": "2", "subject": "Your code is 482910", "from": "noreply@bank.com", "snippet": ""},
+        {"id": "3", "subject": "Verify your account", "from": "paypal@evil.xyz", "snippet": "bit.ly/x"},
+    ]
+
+    with app.test_client() as client, patch('backend_flask.merge_user_analytics') as mock_merge:
+        body = gzip.compress(json.dumps({"emails": emails}).encode())
+        resp = client.post('/classify/batch', data=body,
+                           headers={**headers, "Content-Type": "application/json", "Content-Encoding": "gzip"})
+        assert resp.status_code == 200
+        rows = {r[0]: dict(zip(resp.get_json()["fields"], r)) for r in resp.get_json()["results"]}
+        assert rows["1"]["category"] == "Promotion"
+        assert rows["2"]["category"] == "OTP / Auth"
+        assert rows["3"]["category"] == "Phishing Risk" and rows["3"]["archive"] is True
+        assert not mock_merge.called  # classifying does not add to the analytics aggregate
+        print("  ✅ Gzipped batch scored server-side.")
+
+        too_many = {"emails": [{"subject": "x"}] * (backend_flask.MAX_CLASSIFY_BATCH + 1)}
+        resp = client.post('/classify/batch', headers=headers, json=too_many)
+        assert resp.status_code == 413
+        print("  ✅ Oversized batches rejected.")
+
+        big = b'{"emails": [' + b'{"subject": "x"},' * (backend_flask.MAX_CLASSIFY_BYTES // 16) + b'{}]}'
+        for max_length in (backend_flask.MAX_CLASSIFY_BYTES, None):
+            with patch.dict(app.config, {"MAX_CONTENT_LENGTH": max_length}):
+                resp = client.post('/classify/batch', input_stream=io.BytesIO(big),
+                                   headers={**headers, "Content-Type": "application/json",
+                                            "Transfer-Encoding": "chunked"},
+                                   environ_overrides={"wsgi.input_terminated": True})
+            assert resp.status_code == 413 and "too large" in resp.get_json()["error"]
+        print("  ✅ Chunked uploads without Content-Length are capped.")
+
+        assert client.post('/classify', headers=headers, json=[emails[0]]).status_code == 400
+        assert client.post('/classify', headers=headers,
+                           json={"subject": "Hi", "headers": ["List-Unsubscribe"]}).status_code == 400
+        resp = client.post('/classify/batch', headers=headers,
+                           json={"emails": [{"subject": "Hi", "headers": "List-Unsubscribe: <x>"}]})
+        assert resp.status_code == 400
+        print("  ✅ Non-object bodies and headers are rejected with 400.")
+
+        odd = [{"id": "n", "subject": 5, "from": "x@y.com"}, {"id": "z", "subject": None, "from": "x@y.com"}]
+        for hybrid in (False, True):
+            for item in odd:
+                resp = client.post('/classify', headers=headers, json={**item, "hybrid": hybrid})
+                assert resp.status_code == 200, resp.get_data()
+            resp = client.post('/classify/batch', headers=headers, json={"emails": odd, "hybrid": hybrid})
+            assert resp.status_code == 200 and len(resp.get_json()["results"]) == 2
+        print("  ✅ Non-string subjects are scored as text, with or without the model.")
+        assert not mock_merge.called
+
+def test_explanation_service():
+    print("\nTesting Explanation Cache & Coalescing...")
+    from explain_service import ExplanationService
+    stub = StubLLM(delay=0.3)
+    service = ExplanationService(api_key="test", base_url=stub.url)
+    answers = []
+
+    try:
+        threads = [threading.Thread(target=lambda: answers.append(service.explain("Sale", "shop@x.io", "50% off")))
+                   for _ in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        assert answers == ["Looks like a promotion."] * 5
+        assert len(stub.calls) == 1
+        service.explain("Sale", "shop@x.io", "50% off")
+        assert len(stub.calls) == 1
+        print("  ✅ Concurrent identical requests share one upstream call.")
+
+        emails = [{"subject": f"Newsletter {i}", "from": "news@x.io", "snippet": ""} for i in range(12)]
+        result = service.explain_batch(emails + emails[:2])
+        assert len(result) == 14 and result[12] == result[0]
+        assert len(stub.calls) == 3
+        print("  ✅ Many emails explained in batched prompts.")
+
+        assert service.cache.get(service.content_key("Newsletter 0", "news@x.io", "")) is None
+        service.explain("Newsletter 0", "news@x.io", "")
+        assert len(stub.calls) == 4
+        print("  ✅ Batched answers stay out of the single-email cache.")
+
+        def unparseable(prompt, max_tokens):
+            if "JSON array" in prompt:
+                return "Sorry, here you go:"
+            time.sleep(0.3 if "slow" not in prompt else 5)
+            return "single"
+        fresh = [{"subject": f"Fallback {i}", "from": "news@x.io", "snippet": ""} for i in range(20)]
+        with patch.object(service, "_complete", side_effect=unparseable):
+            start = time.monotonic()
+            assert service.explain_batch(fresh, deadline=3) == ["single"] * 20
+            assert time.monotonic() - start < 2
+            stuck = [{"subject": f"Fallback slow {i}", "from": "news@x.io", "snippet": ""} for i in range(3)]
+            start = time.monotonic()
+            assert service.explain_batch(stuck + fresh[:1], deadline=0.5) == [None, None, None, "single"]
+            assert time.monotonic() - start < 1.5
+        print("  ✅ Single-call fallbacks run concurrently; unfinished emails are None at the deadline.")
+
+        from explain_service import MAX_RETRIES, REQUEST_TIMEOUT, WAIT_TIMEOUT
+        assert service.client.max_retries == MAX_RETRIES
+        assert WAIT_TIMEOUT > (MAX_RETRIES + 1) * REQUEST_TIMEOUT
+        print("  ✅ Waiters outlast the owner's retries.")
+    finally:
+        stub.close()
+
+def test_model_runtime():
+    print("\nTesting NumPy Model Runtime...")
+    import csv
+    import pickle
+    from model_runtime import TextModel
+    with open("vectorizer.pkl", "rb") as f:
+        vectorizer = pickle.load(f)
+    with open("model.pkl", "rb") as f:
+        model = pickle.load(f)
+    with open("emails.csv", newline="", encoding="utf-8") as f:
+        texts = [row["subject"] for row in csv.DictReader(f)]
+    texts += ["", "Your OTP code code CODE", "Ünïcode Sécurité alert", "zzz unknown words only"]
+
+    runtime = TextModel()
+    assert isinstance(runtime.coef, np.memmap)
+    expected = model.predict_proba(vectorizer.transform(texts))
+    assert list(runtime.predict(texts)) == list(model.predict(vectorizer.transform(texts)))
+    assert np.allclose(runtime.predict_proba(texts), expected, atol=1e-12)
+    print(f"  ✅ mmap runtime matches the pickled model on {len(texts)} subjects.")
+
+def test_hybrid_scoring():
+    print("\nTesting Hybrid Rule + Model Scoring...")
+    import scorer
+    from model_runtime import TextModel
+    emails = [
+        {"subject": "Your OTP is 482910", "from": "noreply@bank.com", "snippet": ""},
+        {"subject": "Verify your account now", "from": "paypal@evil.xyz", "snippet": "bit.ly/x"},
+        {"subject": "Lunch on friday?", "from": "alice@example.com", "snippet": ""},
+        {"subject": "Weekly digest", "from": "news@substack.com", "snippet": ""},
+    ]
+    calls = []
+    original = TextModel.predict_proba
+    with patch.object(TextModel, "predict_proba", autospec=True,
+                      side_effect=lambda self, texts, **kw: calls.append(list(texts)) or original(self, texts, **kw)):
+        results = scorer.batch_score(emails, hybrid=True)
+        columns = scorer.score_columns([e["subject"] for e in emails], [e["from"] for e in emails],
+                                       [e["snippet"] for e in emails], hybrid=True)
+
+    rules = scorer.batch_score(emails)
+    assert results[0]["model_probability"] is None and results[0]["confidence"] == rules[0]["confidence"]
+    assert results[1]["model_probability"] is None and results[1]["category"] == "Phishing Risk"
+    assert calls[0] == [["lunch", "on", "friday"], ["weekly", "digest"]]
+    print("  ✅ Decisive OTP/phishing verdicts skip the model; the rest run as one batch.")
+
+    for i, r in enumerate(results):
+        assert r["category"] == columns["category"][i]
+        assert r["confidence"] == columns["confidence"][i]
+    p = results[2]["model_probability"]
+    assert results[2]["confidence"] == min(99, max(30, round(0.6 * rules[2]["confidence"] + 40 * p)))
+    print("  ✅ Model probability blended into confidence, same in column mode.")
+
+def test_online_training():
+    print("\nTesting Online Training & Checkpoints...")
+    import csv
+    import tempfile
+    import train
+    from model_runtime import TextModel
+    with open("emails.csv", newline="", encoding="utf-8") as f:
+        rows = [r for r in csv.DictReader(f)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data, ckpt, out = (os.path.join(tmp, name) for name in ("data.csv", "ckpt.pkl", "model"))
+        with open(data, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, ["subject", "label"])
+            writer.writeheader()
+            writer.writerows(rows * 4)
+
+        # Interrupt the run on its third chunk, then resume from the checkpoint.
+        from sklearn.linear_model import SGDClassifier
+        original, calls = SGDClassifier.partial_fit, []
+        def flaky_fit(self, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return original(self, *args, **kwargs)
+        with patch.object(SGDClassifier, "partial_fit", flaky_fit):
+            try:
+                train.train_online([data], chunk_size=200, checkpoint=ckpt, out_dir=out, resume=False)
+            except KeyboardInterrupt:
+                pass
+        assert train.load_checkpoint(ckpt)["rows"] == 400
+        state = train.train_online([data], chunk_size=200, checkpoint=ckpt, out_dir=out)
+        assert state["trained"] == len(rows) * 4 and state["done"]
+        print("  ✅ Interrupted run resumed from its checkpoint.")
+
+        vectorizer = train.make_vectorizer()
+        texts = [r["subject"] for r in rows]
+        runtime = TextModel(out)
+        assert list(runtime.predict(texts)) == list(state["model"].predict(vectorizer.transform(texts)))
+        print("  ✅ Hashed model exported; NumPy runtime matches sklearn.")
+
+        subject = "Weekly digest from your favourite shop"
+        before = runtime.predict_proba([subject])[0][1]
+        feedback = os.path.join(tmp, "feedback.jsonl")
+        with open(feedback, "w") as f:
+            f.write(json.dumps({"subject": subject, "label": "Wanted"}) + "\n")
+        assert train.apply_feedback(feedback, ckpt, out) == 1
+        assert TextModel(out).predict_proba([subject])[0][1] > before
+        print("  ✅ Feedback applied as an online update.")
+
+def test_feature_records():
+    print("\nTesting Feature Records & Re-Scoring...")
+    import tempfile
+    import scorer
+    from message_store import MessageStore, rescore
+    email = ("🔥 ＦＲＥＥ shipping — today only", "Deals <Deals@Shop.IO>", "visit bit.ly/abc",
+             {"List-Unsubscribe": "<mailto:u@x>"})
+
+    features = scorer.extract_features(*email)
+    assert features["sender_domain"] == "shop.io" and features["links"] == ["bit.ly"]
+    assert features["tokens"] == ["free", "shipping", "today", "only"]
+    assert scorer.score_features(features) == scorer.score_email(*email, use_cache=False)
+    assert features["patterns_version"] == scorer.PATTERNS_VERSION
+    print("  ✅ One feature record drives the rules, with folded tokens for the model.")
+
+    with tempfile.TemporaryDirectory() as tmp, MessageStore(os.path.join(tmp, "m.db")) as store:
+        result = scorer.score_features(features)
+        store.upsert_classifications([{"id": "m1", "subject": email[0], "label": result["label"],
+                                       "confidence": result["confidence"]}])
+        store.upsert_features({"m1": features})
+        assert store.get_features("m1") == features
+
+        # A weight change re-scores from stored signals without running any regex.
+        weights = {**scorer.WEIGHTS, "marketing_language": 40}
+        with patch.dict(scorer.WEIGHTS, weights), \
+             patch.object(scorer, "_match_signal", side_effect=AssertionError("regex ran")):
+            assert rescore(store) == 1
+        assert store.get_classification("m1")["confidence"] == min(99, result["confidence"] + 25)
+
+        # Records from older PATTERNS get their signals recomputed and saved.
+        with patch.object(scorer, "PATTERNS_VERSION", "changed"):
+            rescore(store)
+            assert store.get_features("m1")["patterns_version"] == "changed"
+    print("  ✅ Stored records re-scored after a weight change without text processing.")
+
+    subjects = ["Weekly digest", "Lunch on friday?", "ＡＫＡＲＳＨＡ ＷＥＥＫＬＹ digest", "akarsha weekly digest"]
+    records = [scorer.extract_features(s, "x@y.com") for s in subjects]
+    assert records[2]["tokens"] == records[3]["tokens"] == ["akarsha", "weekly", "digest"]
+    by_tokens = [r["model_probability"] for r in scorer.score_records(records, hybrid=True)]
+    by_subject = [r["model_probability"]
+                  for r in scorer.batch_score([{"subject": s, "from": "x@y.com"} for s in subjects], hybrid=True)]
+    by_column = [round(float(p), 4)
+                 for p in scorer.score_columns(subjects, ["x@y.com"] * len(subjects), hybrid=True)["model_probability"]]
+    token = create_backend_token("features@example.com")
+    with app.test_client() as client:
+        by_request = [client.post('/classify', headers={"Authorization": f"Bearer {token}"},
+                                  json={"subject": s, "from": "x@y.com", "hybrid": True}).get_json()["model_probability"]
+                      for s in subjects]
+    assert by_tokens == by_subject == by_column == by_request, (by_tokens, by_subject, by_column, by_request)
+    assert by_tokens[2] == by_tokens[3]
+    print("  ✅ Every hybrid path feeds the model the same folded tokens.")
+
+    import train
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "labels.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"subject": subjects[2], "label": "Wanted"}) + "\n")
+        assert list(train.iter_labeled(path)) == [(scorer.fold_text(subjects[2]), "Wanted")]
+    print("  ✅ Training folds subjects the same way.")
+
+def test_literal_prefilter():
+    print("\nTesting Literal Prefilter...")
+    import random
+    import scorer
+    assert "bit.ly/" in scorer.PREFILTERS["suspicious_link"]
+    assert scorer._required_literals(r"\b(sale|save \d+%)\b") == {"sale", "save "}
+    assert scorer._required_literals(r"opt.?out") == {"opt"}
+    assert scorer._required_literals(r"(?i)unsubscribe") is None
+
+    rng = random.Random(7)
+    pieces = [l for lits in scorer.PREFILTERS.values() if lits for l in lits]
+    pieces += list("abcxyz .@/:#%0123456789") + ["re:", "paypal", "@paypal.com", " your "]
+    for _ in range(5000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 20)))
+        for key, (anchored, floating) in scorer.COMPILED_PATTERNS.items():
+            expected = bool((anchored and anchored.match(text)) or (floating and floating.search(text)))
+            assert scorer._match_signal(text, key) == expected, (key, text)
+    print("  ✅ Prefiltered signals identical to the full regexes.")
+
+    with patch.object(scorer, "_required_literals", side_effect=AttributeError("no _parser")):
+        fallback = scorer._build_prefilters(scorer.PATTERNS)
+    assert fallback == {key: None for key in scorer.PATTERNS}
+    with patch.dict(scorer.PREFILTERS, fallback):
+        assert scorer._check("Verify your account: bit.ly/x", "suspicious_link")
+        assert not scorer._check("Lunch on friday?", "suspicious_link")
+    print("  ✅ Prefilter analysis failure falls back to the full regexes.")
+
+    anchored, floating = scorer.COMPILED_PATTERNS["social_update"]
+    spy = MagicMock(wraps=floating)
+    with patch.dict(scorer.COMPILED_PATTERNS, {"social_update": (anchored, spy)}):
+        assert not scorer._match_signal("lunch on friday? alice@example.com", "social_update")
+        assert spy.search.call_count == 0
+        assert scorer._match_signal("bob liked your photo", "social_update")
+        assert spy.search.call_count == 1
+    print("  ✅ Regex skipped when none of its literals occur.")
+
+def test_scorer_cache():
+    print("\nTesting Scorer Result & Sender Caches...")
+    import scorer
+    import ttl_cache
+    assert scorer._result_key("a\x00b", "c", "", False, False) != scorer._result_key("a", "b\x00c", "", False, False)
+    print("  ✅ Cache keys keep field boundaries.")
+
+    emails = [("Flash sale today only", "deals@shop.io", "", {"List-Unsubscribe": "<mailto:u@x>"}),
+              ("Your code is 482910", "noreply@bank.com", "", None),
+              ("Lunch on friday?", "alice@example.com", "", None)]
+    with patch.object(scorer, "RESULT_CACHE", ttl_cache.TTLCache(maxsize=2)), \
+         patch.object(scorer, "SENDER_CACHE", ttl_cache.TTLCache(maxsize=10, ttl=60)):
+        for email in emails:
+            assert scorer.score_email(*email) == scorer.score_email(*email, use_cache=False)
+        stats = scorer.cache_stats()["results"]
+        assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (0, 3, 1, 2)
+        cached = scorer.score_email(*emails[2])
+        cached["reasons"].append("mutated by caller")
+        assert scorer.score_email(*emails[2]) == scorer.score_email(*emails[2], use_cache=False)
+        assert scorer.cache_stats()["results"]["hits"] == 2
+        print("  ✅ Cached results match uncached ones; hits, misses and LRU evictions are counted.")
+
+        clock = [ttl_cache.time.monotonic()]
+        with patch.object(ttl_cache.time, "monotonic", lambda: clock[0]):
+            scorer.SENDER_CACHE.set("news@list.io", {"bulk_sender_pattern": True})
+            assert scorer.SENDER_CACHE.get("news@list.io") is not None
+            clock[0] += 61
+            assert scorer.SENDER_CACHE.get("news@list.io") is None
+        assert scorer.cache_stats()["senders"]["evictions"] == 1
+        print("  ✅ Sender entries expire after their TTL.")
+
+def test_parallel_backpressure():
+    print("\nTesting Parallel Scoring Backpressure...")
+    import scorer
+    consumed = []
+
+    def emails():
+        for i in range(2000):
+            consumed.append(i)
+            yield {"subject": f"Weekly sale {i}", "from": "news@shop.com"}
+
+    try:
+        results = scorer.score_parallel(emails(), workers=2, chunk_size=50, max_pending=3)
+        first = next(results)
+        assert first["category"] == scorer.batch_score([{"subject": "Weekly sale 0", "from": "news@shop.com"}])[0]["category"]
+        assert len(consumed) <= 3 * 50
+        print("  ✅ Input is read at most max_pending chunks ahead.")
+        assert 1 + sum(1 for _ in results) == 2000 and len(consumed) == 2000
+        print("  ✅ Every email is scored.")
+    finally:
+        scorer.shutdown_pool()
+
+STREAM_FIXTURES = {
+    "bodyless": (b"Message-ID: <a@x>\nFrom: alerts@bank.com\nSubject: Statement ready\n"
+                 b"Content-Type: multipart/mixed; boundary=B\n\n--B\n"
+                 b"Content-Type: application/pdf\n\nJVBERi0=\n--B--\n"),
+    "html": (b"Message-ID: <b@x>\nFrom: deals@shop.io\nSubject: Flash sale\n"
+             b"List-Unsubscribe: <mailto:u@shop.io>\nContent-Type: text/html\n\n"
+             b"<p>Limited   time <b>50% off</b></p>\n"),
+    "noid": (b"From: alice@example.com\nSubject: Lunch?\n\nAre you free on Friday?\n"),
+}
+
+def test_stream_readers():
+    print("\nTesting Streaming Readers...")
+    import tempfile
+    import stream_scorer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        eml_dir = os.path.join(tmp, "eml")
+        os.mkdir(eml_dir)
+        for name, raw in STREAM_FIXTURES.items():
+            with open(os.path.join(eml_dir, f"{name}.eml"), "wb") as f:
+                f.write(raw)
+        mbox = os.path.join(tmp, "inbox.mbox")
+        with open(mbox, "wb") as f:
+            for raw in STREAM_FIXTURES.values():
+                f.write(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2026\n" + raw + b"\n")
+        jsonl = os.path.join(tmp, "inbox.jsonl")
+        with open(jsonl, "w") as f:
+            f.write(json.dumps({"id": "a", "subject": "Statement ready", "from": "alerts@bank.com"}) + "\n")
+            f.write(json.dumps({"id": "b", "subject": "Flash sale", "from": "deals@shop.io",
+                                "snippet": "Limited time 50% off",
+                                "headers": {"List-Unsubscribe": "<mailto:u@shop.io>"}}) + "\n")
+            f.write(json.dumps({"subject": "Lunch?", "from": "alice@example.com"}) + "\n")
+
+        mbox_records = list(stream_scorer.iter_mbox(mbox))
+        eml_records = {r["id"]: r for r in stream_scorer.iter_eml_dir(eml_dir)}
+        assert [r["snippet"] for r in mbox_records] == ["", "Limited time 50% off", "Are you free on Friday?"]
+        assert eml_records["<a@x>"]["snippet"] == ""
+        assert eml_records["<b@x>"]["snippet"] == "Limited time 50% off"
+        print("  ✅ Body-less messages give an empty snippet; HTML bodies are stripped.")
+        assert mbox_records[2]["id"] == "" and "noid.eml" in eml_records
+        print("  ✅ Messages without a Message-ID are still read.")
+
+        array = os.path.join(tmp, "inbox.json")
+        with open(jsonl) as f, open(array, "w") as out:
+            json.dump([json.loads(line) for line in f], out, indent=2)
+        assert list(stream_scorer.iter_records(array)) == list(stream_scorer.iter_records(jsonl))
+        import train
+        labeled = list(train.iter_labeled("classified_emails.json"))
+        assert labeled and all(label in train.CLASSES for _, label in labeled)
+        print("  ✅ .json files holding one array are read as well as JSONL.")
+
+        for src in (jsonl, array, mbox, eml_dir):
+            summary = stream_scorer.score_file(src, os.path.join(tmp, "out.jsonl"))
+            assert summary["total"] == 3, (src, summary)
+            with open(os.path.join(tmp, "out.jsonl")) as f:
+                scored = [json.loads(line) for line in f]
+            assert len(scored) == 3 and all("category" in r for r in scored)
+        print("  ✅ JSONL, JSON array, mbox and EML inputs all score end to end.")
+
+def test_message_store():
+    print("\nTesting Message Store...")
+    import sqlite3
+    import tempfile
+    from message_store import MessageStore, _MAX_VARS
+
+    with tempfile.TemporaryDirectory() as tmp, MessageStore(os.path.join(tmp, "m.db")) as store:
+        store.upsert_classifications([{"id": "a", "subject": "Sale", "label": "AI/Promotions",
+                                       "confidence": 0.7, "sender": "shop@x.io"}])
+        store.upsert_classifications([{"id": "a", "subject": "Sale", "label": "AI/Phishing",
+                                       "confidence": 0.9, "moved": True}])
+        assert store.get_classification("a") == {"id": "a", "subject": "Sale", "label": "AI/Phishing",
+                                                  "confidence": 0.9, "moved": True}
+        assert store.is_processed("a")
+        print("  ✅ Upsert replaces the stored classification and marks it processed.")
+
+        ids = [f"m{i}" for i in range(_MAX_VARS * 2 + 5)]
+        store.mark_processed(ids[::2])
+        assert store.filter_unprocessed(iter(ids)) == ids[1::2]
+        print("  ✅ filter_unprocessed spans several IN (...) chunks.")
+
+        try:
+            store.upsert_classifications([{"id": "b", "label": "x"}, {"id": None, "label": "y"}])
+            raise AssertionError("expected the batch to fail")
+        except sqlite3.IntegrityError:
+            pass
+        assert store.get_classification("b") is None and not store.is_processed("b")
+        print("  ✅ A failed batch is rolled back as a whole.")
+
+        with open(os.path.join(tmp, "ids.json"), "w") as f:
+            json.dump(["old1", "old2"], f)
+        with open(os.path.join(tmp, "classified.json"), "w") as f:
+            json.dump([{"id": "old1", "subject": "Hi", "label": "AI/Social", "confidence": 0.5}], f)
+        for _ in range(2):
+            counts = store.import_legacy(os.path.join(tmp, "ids.json"), os.path.join(tmp, "classified.json"))
+        assert counts == {"processed": 2, "classifications": 1}
+        assert store.get_classification("old1")["label"] == "AI/Social"
+        assert store.processed_count() == 1 + len(ids[::2]) + 2
+        print("  ✅ import_legacy loads the JSON files and is safe to re-run.")
+
+        def writer(n):
+            for i in range(50):
+                store.upsert_classifications([{"id": f"t{n}-{i}", "label": "x"}])
+                store.filter_unprocessed([f"t{n}-{i}", "nope"])
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        assert sum(1 for r in store.iter_classifications() if r["id"].startswith("t")) == 400
+        print("  ✅ Concurrent threads share the connection safely.")
+
+def test_gmail_batch_fetch():
+    print("\nTesting Gmail Batch Fetch...")
+    import gmail_utils
+
+    gmail = FakeGmail(1203)
+    ids = list(gmail_utils.list_message_ids(gmail))
+    assert ids == sorted(gmail.mail) and gmail.count("messages.list") == 3
+    assert len(list(gmail_utils.list_message_ids(gmail, max_results=510))) == 510
+    print("  ✅ Listing follows nextPageToken across pages.")
+
+    gmail.errors = {"batch": [429], "messages.get": [429, 429]}
+    with patch.object(gmail_utils, "_backoff") as backoff:
+        emails = gmail_utils.fetch_metadata_batch(gmail, ids[:120], pacer=gmail_utils.QuotaPacer(1e9))
+    assert [e["id"] for e in emails] == ids[:120]
+    assert gmail.batches == [50, 50, 50, 20, 2]
+    assert backoff.call_count == 2
+    print("  ✅ Batches hold 50 gets; a throttled batch and throttled gets are retried.")
+
+    gmail.errors = {"batch": [400]}
+    try:
+        gmail_utils.fetch_metadata_batch(gmail, ids[:5], pacer=gmail_utils.QuotaPacer(1e9))
+        raise AssertionError("expected HttpError")
+    except gmail_utils.HttpError as e:
+        assert e.resp.status == 400
+    print("  ✅ Non-retryable batch errors propagate.")
+
+    clock = [0.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+    with patch.object(gmail_utils.time, "monotonic", lambda: clock[0]), \
+         patch.object(gmail_utils.time, "sleep", sleep):
+        pacer = gmail_utils.QuotaPacer()
+        for _ in range(3):
+            pacer.wait(50 * gmail_utils.GET_QUOTA_UNITS)
+    assert sleeps == [1.0, 1.0]
+    print("  ✅ Batches are paced to 250 quota units per second.")
+
+def test_gmail_labels():
+    print("\nTesting Gmail Label Cache & Bulk Moves...")
+    import gmail_utils
+
+    gmail_utils._label_resolvers.clear()
+    gmail, owner = FakeGmail(2500), "a@example.com"
+    ids = sorted(gmail.mail)
+    assert gmail_utils.bulk_move(gmail, [(m, "AI/Promotions") for m in ids], account=owner) == {"AI/Promotions": 2500}
+    assert [len(kw["body"]["ids"]) for n, kw in gmail.calls if n == "messages.batchModify"] == [1000, 1000, 500]
+    print("  ✅ batchModify sent in chunks of 1,000 IDs.")
+
+    gmail_utils.bulk_move(gmail, [(ids[0], "AI/Promotions")], account=owner)
+    gmail_utils.move_to_label(gmail, ids[1], "AI/Promotions", account=owner)
+    assert gmail.count("labels.list") == 1 and gmail.count("labels.create") == 1
+    print("  ✅ Label IDs are cached across calls.")
+
+    gmail.label_list = [l for l in gmail.label_list if l["name"] != "AI/Promotions"]
+    gmail_utils.bulk_move(gmail, [(ids[2], "AI/Promotions")], account=owner)
+    new_id = next(l["id"] for l in gmail.label_list if l["name"] == "AI/Promotions")
+    assert new_id in gmail.mail[ids[2]]["labelIds"]
+    assert gmail.count("labels.list") == 2 and gmail.count("labels.create") == 2
+    print("  ✅ A deleted label is resolved again after Gmail rejects it.")
+
+    real_list = gmail._labels_list
+    def racing_list(userId):
+        resp = real_list(userId)
+        gmail.label_list.append({"id": "Label_race", "name": "AI/Race"})  # created elsewhere meanwhile
+        gmail._labels_list = real_list
+        return resp
+    gmail._labels_list = racing_list
+    gmail_utils.move_to_label(gmail, ids[3], "AI/Race", account=owner)
+    assert "Label_race" in gmail.mail[ids[3]]["labelIds"]
+    print("  ✅ A 409 on create picks up the concurrently created label.")
+
+    # Two mailboxes whose label IDs overlap: Label_1 is a different label in each.
+    first, second = FakeGmail(1), FakeGmail(1)
+    first.label_list.append({"id": "Label_1", "name": "AI/Social"})
+    second.label_list.append({"id": "Label_1", "name": "Receipts"})
+    gmail_utils.move_to_label(first, "m0000", "AI/Social", account="first@example.com")
+    gmail_utils.move_to_label(second, "m0000", "AI/Social", account="second@example.com")
+    assert first.mail["m0000"]["labelIds"] == ["Label_1"]
+    assert second.mail["m0000"]["labelIds"] == ["Label_2"]
+    assert second.count("labels.list") == 1 and second.count("labels.create") == 1
+    try:
+        gmail_utils.bulk_move(first, [("m0000", "AI/Social")], account="me")
+        assert False, "'me' must not share one label cache across accounts"
+    except ValueError:
+        pass
+    print("  ✅ Label caches are per account; IDs never leak between mailboxes.")
+    gmail_utils._label_resolvers.clear()
+
+def test_gmail_sync():
+    print("\nTesting Incremental Gmail Sync...")
+    import tempfile
+    import gmail_utils
+    from message_store import MessageStore
+
+    gmail = FakeGmail(3)
+    with tempfile.TemporaryDirectory() as tmp, MessageStore(os.path.join(tmp, "m.db")) as store:
+        emails, history_id = gmail_utils.sync_mailbox(gmail, store)
+        assert [e["id"] for e in emails] == sorted(gmail.mail) and history_id == "1000"
+        assert gmail.count("users.getProfile") == 1 and gmail.count("history.list") == 0
+        assert store.get_history_id("me") is None
+        print("  ✅ First sync lists the mailbox; the history ID is returned, not saved.")
+
+        store.mark_processed(e["id"] for e in emails)
+        store.set_history_id("me", history_id)
+        for msg_id, labels in [("n1", ["INBOX"]), ("n2", ["SENT"]), ("n3", ["INBOX", "UNREAD"]), ("n4", ["INBOX"])]:
+            gmail.deliver(msg_id, labels)
+        emails, history_id = gmail_utils.sync_mailbox(gmail, store)
+        assert [e["id"] for e in emails] == ["n1", "n3", "n4"] and history_id == "1004"
+        assert gmail.count("history.list") == 2 and gmail.count("users.getProfile") == 1
+        assert gmail.count("messages.list") == 1
+        assert store.get_history_id("me") == "1000"
+        print("  ✅ Incremental sync pages history.list and skips other labels.")
+
+        store.mark_processed(["n1"])
+        gmail.oldest_history_id = 1002
+        emails, history_id = gmail_utils.sync_mailbox(gmail, store)
+        assert [e["id"] for e in emails] == ["n3", "n4"] and history_id == "1004"
+        assert gmail.count("users.getProfile") == 2 and gmail.count("messages.list") == 2
+        assert store.get_history_id("me") == "1000"
+        print("  ✅ An expired history ID (404) falls back to a full resync.")
+
+class StubGmailAPI:
+    """
+    Local HTTP stand-in for the Gmail REST API. `script` is consumed one
+    entry per request: a status code, (status, headers), "garbage" to reply
+    with a malformed status line, or "slow" to stall past the client timeout.
+    Once it is empty every request gets 200 with `{"labels": []}`, or
+    `{"id": ...}` for messages/<id>.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.hits += 1
+                step = stub.script.pop(0) if stub.script else 200
+                if step == "garbage":
+                    self.wfile.write(b"NOT HTTP\r\n\r\n")
+                    self.close_connection = True
+                    return
+                if step == "slow":
+                    time.sleep(0.5)
+                    self.close_connection = True
+                    return
+                status, headers = step if isinstance(step, tuple) else (step, {})
+                if status != 200:
+                    payload = {"error": status}
+                elif "/messages/" in self.path:
+                    payload = {"id": self.path.split("/messages/")[1].split("?")[0]}
+                else:
+                    payload = {"labels": []}
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+def test_async_gmail_client():
+    print("\nTesting Async Gmail Client...")
+    import asyncio
+    import gmail_async
+    from gmail_async import AsyncGmailClient, GmailAPIError, TokenBucket
+
+    async def bucket_timing():
+        bucket = TokenBucket(1000)
+        start = time.monotonic()
+        await bucket.acquire(1000)
+        burst = time.monotonic() - start
+        await bucket.acquire(200)
+        return burst, time.monotonic() - start
+    burst, total = asyncio.run(bucket_timing())
+    assert burst < 0.05 and 0.15 < total < 0.5
+    bucket = TokenBucket(320)
+    for _ in range(10):
+        bucket.slow_down()
+    assert bucket.rate == 10
+    bucket.speed_up()
+    assert bucket.rate == 10 + 320 / 50
+    print("  ✅ Token bucket allows a full burst, then refills at its rate.")
+
+    real_sleep = asyncio.sleep
+    delays = []
+    async def fake_sleep(seconds):
+        delays.append(seconds)
+        await real_sleep(0)
+
+    async def call(stub, timeout=5):
+        async with AsyncGmailClient("token", base_url=stub.url, timeout=timeout) as gmail:
+            rate_before = gmail.bucket.rate
+            labels = await gmail.list_labels()
+            return labels, rate_before, gmail.bucket.rate
+
+    with patch.object(gmail_async.asyncio, "sleep", fake_sleep), \
+         patch.object(gmail_async.random, "random", lambda: 0.0):
+        stub = StubGmailAPI([(429, {"Retry-After": "7"}), 503, 429])
+        try:
+            labels, rate_before, rate_after = asyncio.run(call(stub))
+        finally:
+            stub.close()
+        assert labels == [] and stub.hits == 4
+        assert delays == [7.0, 2, 4]
+        assert rate_after < rate_before
+        print("  ✅ 429/5xx back off exponentially and honour Retry-After.")
+
+        delays.clear()
+        stub = StubGmailAPI(["garbage", "slow"])
+        try:
+            labels, _, _ = asyncio.run(call(stub, timeout=0.2))
+        finally:
+            stub.close()
+        assert labels == [] and stub.hits == 3 and delays == [1, 2]
+        print("  ✅ Client errors and timeouts are retried like 5xx.")
+
+        stub = StubGmailAPI([404])
+        try:
+            asyncio.run(call(stub))
+            raise AssertionError("expected GmailAPIError")
+        except GmailAPIError as e:
+            assert e.status == 404 and stub.hits == 1
+        finally:
+            stub.close()
+        print("  ✅ Other errors are not retried.")
+
+        async def fetch(stub):
+            async with AsyncGmailClient("token", base_url=stub.url) as gmail:
+                return await gmail.get_messages_metadata(["a", "b", "c"])
+        stub = StubGmailAPI([404])
+        try:
+            msgs = asyncio.run(fetch(stub))
+        finally:
+            stub.close()
+        assert len(msgs) == 2 and {m["id"] for m in msgs} < {"a", "b", "c"} and stub.hits == 3
+        print("  ✅ A message that fails for good is logged and skipped, not fatal.")
+
+    async def batch_modify_at_low_quota():
+        async with AsyncGmailClient("token", quota_per_second=25) as gmail:
+            assert gmail.bucket.capacity == gmail_async.QUOTA_UNITS["messages.batchModify"]
+            await asyncio.wait_for(gmail.bucket.acquire(gmail_async.QUOTA_UNITS["messages.batchModify"]), 5)
+        try:
+            await TokenBucket(25).acquire(50)
+            raise AssertionError("expected ValueError")
+        except ValueError:
+            pass
+    asyncio.run(batch_modify_at_low_quota())
+    print("  ✅ The bucket always fits the costliest call; oversized requests raise.")
+
+def test_metrics_auth():
+    print("\nTesting Metrics Access...")
+    user_headers = {"Authorization": f"Bearer {create_backend_token('user@example.com')}"}
+
+    with app.test_client() as client:
+        with patch.object(backend_flask, 'METRICS_TOKEN', None):
+            assert client.get('/metrics', headers={"Authorization": "Bearer "}).status_code == 403
+        with patch.object(backend_flask, 'METRICS_TOKEN', 'ops-secret'):
+            assert client.get('/metrics').status_code == 403
+            assert client.get('/metrics', headers=user_headers).status_code == 403
+            resp = client.get('/metrics', headers={"Authorization": "Bearer ops-secret"})
+            assert resp.status_code == 200 and "user_cache" in resp.get_json()
+    print("  ✅ /metrics requires the admin token; user tokens are refused.")
+
+def test_supabase_retries():
+    print("\nTesting Supabase Retry Policy...")
+    import requests
+    from supabase_client import SupabaseClient, SupabaseError
+
+    def ok(body):
+        resp = MagicMock(status_code=200, content=json.dumps(body).encode())
+        resp.json.return_value = body
+        return resp
+    unavailable = MagicMock(status_code=503, text="unavailable")
+
+    client = SupabaseClient("http://supabase.test", "key")
+    with patch('supabase_client.time.sleep'):
+        with patch.object(client.session, 'request', side_effect=[unavailable, requests.ReadTimeout(), ok([])]) as send:
+            assert client.request("GET", "users") == []
+            assert send.call_count == 3
+        print("  ✅ Reads retry timeouts and 5xx.")
+
+        with patch.object(client.session, 'request', side_effect=[requests.ConnectionError(), ok(3)]) as send:
+            assert client.increment_scan("a@example.com", 5, "2026-01-01") == 3
+            assert send.call_count == 2
+        for failure in (requests.ReadTimeout(), unavailable):
+            with patch.object(client.session, 'request', side_effect=[failure, ok(4)]) as send:
+                try:
+                    client.increment_scan("a@example.com", 5, "2026-01-01")
+                    raise AssertionError("expected SupabaseError")
+                except SupabaseError:
+                    pass
+                assert send.call_count == 1
+        print("  ✅ The scan counter retries connection errors only, never a timeout or 5xx.")
+
+        from supabase_client import UserNotFound
+        missing_rpc = MagicMock(status_code=404, text="function not found")
+        for replies in ([ok(-1)], [missing_rpc, ok([])]):
+            with patch.object(client.session, 'request', side_effect=replies):
+                try:
+                    client.increment_scan("gone@example.com", None, "2026-01-01")
+                    raise AssertionError("expected UserNotFound")
+                except UserNotFound:
+                    pass
+        print("  ✅ A missing users row raises UserNotFound, via the RPC and the CAS fallback.")
+
+def test_model_publish():
+    print("\nTesting Atomic Model Export & Reload...")
+    import pickle
+    import shutil
+    import tempfile
+    import model_runtime
+    with open("vectorizer.pkl", "rb") as f:
+        vectorizer = pickle.load(f)
+    with open("model.pkl", "rb") as f:
+        model = pickle.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "model")
+        shutil.copytree(model_runtime.MODEL_DIR, out)
+        assert model_runtime.resolve_model_dir(out) == out
+        flat = model_runtime.load_model(out)  # the committed layout: arrays directly in model/
+        print("  ✅ A flat model/ directory without CURRENT still loads.")
+
+        model_runtime.export_model(vectorizer, model, out)
+        assert os.path.isdir(out) and not os.path.islink(out)
+        version = open(os.path.join(out, "CURRENT")).read().strip()
+        assert model_runtime.resolve_model_dir(out) == os.path.join(out, version)
+        assert os.path.exists(os.path.join(out, version, "meta.json"))
+        first = model_runtime.load_model(out)
+        assert first is not flat and model_runtime.load_model(out) is first
+        print("  ✅ Export publishes a versioned subdirectory behind model/CURRENT.")
+
+        model.intercept_ = model.intercept_ + 5.0
+        model_runtime.export_model(vectorizer, model, out)
+        second = model_runtime.load_model(out)
+        assert second is not first
+        assert second.intercept[0] == first.intercept[0] + 5.0
+        assert list(first.predict(["Weekly sale"])) == list(first.predict(["Weekly sale"]))
+        print("  ✅ load_model reloads after CURRENT changes; old readers keep working.")
+
+        for _ in range(3):
+            model_runtime.export_model(vectorizer, model, out)
+        versions = [e.name for e in os.scandir(out) if e.is_dir()]
+        assert len(versions) == 2 and open(os.path.join(out, "CURRENT")).read().strip() in versions
+        assert not [e for e in os.listdir(out) if e.startswith(".")]
+        print("  ✅ Only the current and previous exports are kept.")
+
 if __name__ == "__main__":
     try:
         test_jwt_authentication()
         test_usage_tracking()
         test_cleanup_validation()
+        test_analytics_aggregate()
+        test_user_cache()
+        test_supabase_bulk()
+        test_atomic_scan_counter()
+        test_lazy_daily_reset()
+        test_google_token_cache()
+        test_refresh_tokens()
+        test_classify_batch()
+        test_explanation_service()
+        test_model_runtime()
+        test_model_publish()
+        test_hybrid_scoring()
+        test_online_training()
+        test_feature_records()
+        test_literal_prefilter()
+        test_scorer_cache()
+        test_parallel_backpressure()
+        test_stream_readers()
+        test_message_store()
+        test_gmail_batch_fetch()
+        test_gmail_labels()
+        test_gmail_sync()
+        test_async_gmail_client()
+        test_metrics_auth()
+        test_supabase_retries()
         print("\n🎉 ALL PRODUCTION BACKEND TESTS PASSED!")
     except Exception as e:
         import traceback
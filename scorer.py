@@ -4,7 +4,20 @@ Zero external API calls for basic classification.
 OpenAI used ONLY for premium deep-analysis.
 """
 
+import atexit
+import hashlib
+import json
+import logging
+import multiprocessing
 import re
+import unicodedata
+from collections import deque
+from email.utils import parseaddr
+from itertools import islice
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("inboxai")
 
 # ── Signal Weights ─────────────────────────────────────────────────────────────
 WEIGHTS = {
@@ -117,6 +130,24 @@ CATEGORY_MAP = {
     "Important":       lambda s: s["personal_reply_signal"] or s["meeting_calendar"],
 }
 
+# Same rules as CATEGORY_MAP, written with element-wise operators so they can be
+# applied to whole columns of signals at once (see score_columns). Keep the two
+# in sync: order matters, the first matching category wins.
+CATEGORY_MASKS = {
+    "Phishing Risk":   lambda s: s["suspicious_link"] | s["spoofed_sender"] | s["urgency_tactic"],
+    "Security Alert":  lambda s: s["security_alert"] & ~(s["suspicious_link"] | s["spoofed_sender"]),
+    "OTP / Auth":      lambda s: s["otp_transactional"],
+    "Finance":         lambda s: s["finance_pattern"] & ~s["suspicious_link"],
+    "Order Update":    lambda s: s["order_confirmation"],
+    "Recruiter":       lambda s: s["recruiter_pattern"],
+    "Newsletter":      lambda s: s["newsletter_pattern"] | (s["unsubscribe_footer"] & s["bulk_sender_pattern"]),
+    "Promotion":       lambda s: s["marketing_language"] | s["promotional_subject"],
+    "Social Update":   lambda s: s["social_update"],
+    "Meeting / Event": lambda s: s["meeting_calendar"],
+    "Important":       lambda s: s["personal_reply_signal"] | s["meeting_calendar"],
+}
+assert list(CATEGORY_MASKS) == list(CATEGORY_MAP)
+
 LABEL_FOR_CATEGORY = {
     "Phishing Risk":   "AI/Phishing Risk",
     "Security Alert":  "AI/Security",
@@ -134,26 +165,292 @@ LABEL_FOR_CATEGORY = {
 REMOVE_FROM_INBOX = {"Newsletter", "Promotion", "Social Update", "Phishing Risk"}
 
 
-def _check(text: str, pattern_key: str) -> bool:
-    text_lower = text.lower()
-    return any(re.search(p, text_lower) for p in PATTERNS[pattern_key])
+# ── Compiled Engine ────────────────────────────────────────────────────────────
+# Each signal's patterns are joined into one alternation and compiled once at
+# import. Patterns anchored with "^" go into a separate regex run with .match(),
+# so they are not retried at every offset of the text.
+def _compile_signal(patterns: list) -> tuple:
+    anchored = [p[1:] for p in patterns if p.startswith("^")]
+    floating = [p for p in patterns if not p.startswith("^")]
+    return (
+        re.compile("|".join(f"(?:{p})" for p in anchored)) if anchored else None,
+        re.compile("|".join(f"(?:{p})" for p in floating)) if floating else None,
+    )
 
 
-def score_email(subject: str, sender: str, body_snippet: str = "", headers: dict = None) -> dict:
+COMPILED_PATTERNS = {key: _compile_signal(patterns) for key, patterns in PATTERNS.items()}
+
+
+# ── Literal Prefilter ──────────────────────────────────────────────────────────
+# For each signal's floating regex, derive a set of literals of which at least
+# one must occur in any match (e.g. "bit.ly/" for r"bit\.ly/", or every word of
+# a \b(sale|deal|...)\b alternation). The regex only runs when one of them is
+# in the text. That is a necessary condition, so signals stay exact; most mail
+# contains none of a signal's literals and skips its regex entirely. Literals
+# are found by walking re's own parse tree, so edits to PATTERNS are picked up
+# automatically; a pattern nothing can be derived from disables the prefilter
+# for its signal. Substring checks with `in` run in C and beat a pure-Python
+# Aho-Corasick automaton here.
+_MAX_EXPANSION = 64
+
+
+def _best(candidates: list):
+    """Most selective usable literal set: longest shortest-literal, then fewest."""
+    usable = [c for c in candidates if c and "" not in c]
+    if not usable:
+        return None
+    return max(usable, key=lambda c: (min(map(len, c)), -len(c)))
+
+
+def _literal_info(items, prefix=frozenset({""})) -> tuple:
     """
-    Score a single email. Returns full classification result.
-    All local — zero API calls.
+    Return (exact, required) for a parsed sequence preceded by any string in
+    `prefix`: `exact` is the finite set of strings the two can match together
+    (or None), `required` a set of literals one of which every match contains
+    (or None).
     """
-    full_text = f"{subject} {sender} {body_snippet}"
-    headers = headers or {}
+    from re import _constants as c
+
+    candidates = []
+    run = set(prefix)
+    all_exact = True
+    for op, arg in items:
+        exact, required, joined = None, None, None
+        if op is c.LITERAL:
+            exact = {chr(arg)}
+        elif op in (c.AT, c.ASSERT, c.ASSERT_NOT):
+            exact = {""}
+        elif op is c.SUBPATTERN:
+            if not arg[1] & c.SRE_FLAG_IGNORECASE:
+                joined, required = _literal_info(arg[-1], run)
+        elif op is c.BRANCH:
+            # re factors common prefixes out of alternations ("sa(le|ve \d+%)"),
+            # so each branch continues the current run.
+            infos = [_literal_info(branch, run) for branch in arg[1]]
+            if all(e is not None for e, _ in infos):
+                joined = set().union(*(e for e, _ in infos))
+            else:
+                parts = [_best([r, e]) for e, r in infos]
+                required = None if None in parts else set().union(*parts)
+        elif op is c.IN:
+            if all(o is c.LITERAL for o, _ in arg) and len(arg) <= 8:
+                exact = {chr(v) for _, v in arg}
+        elif op in (c.MAX_REPEAT, c.MIN_REPEAT):
+            low, high, body = arg
+            body_exact, body_required = _literal_info(body)
+            if low == high and body_exact is not None and len(body_exact) ** low <= _MAX_EXPANSION:
+                exact = {""}
+                for _ in range(low):
+                    exact = {a + b for a in exact for b in body_exact}
+            elif low >= 1:
+                required = _best([body_required, body_exact])
+
+        if joined is not None and len(joined) <= _MAX_EXPANSION:
+            run = joined
+            continue
+        if exact is not None and len(run) * len(exact) <= _MAX_EXPANSION:
+            run = {a + b for a in run for b in exact}
+            continue
+        # The run of exact items ends here; it and this item are both candidates.
+        all_exact = False
+        candidates += [run, required]
+        run = exact if exact is not None else {""}
+
+    if all_exact:
+        return run, _best([run])
+    return None, _best(candidates + [run])
+
+
+def _required_literals(pattern: str):
+    from re import _parser
+
+    parsed = _parser.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    exact, required = _literal_info(parsed)
+    return _best([required, exact])
+
+
+def _signal_prefilter(patterns: list):
+    """Union of the required literals of each floating pattern, or None."""
+    literals = set()
+    for p in patterns:
+        if p.startswith("^"):
+            continue
+        required = _required_literals(p)
+        if required is None:
+            return None
+        literals |= required
+    # A literal that contains another one is redundant.
+    return tuple(sorted(l for l in literals if not any(o != l and o in l for o in literals))) or None
+
+
+def _build_prefilters(patterns: dict) -> dict:
+    """
+    Prefilter literals per signal. The analysis walks the private re._parser
+    tree, so if it fails (e.g. on another Python version) every signal falls
+    back to None: no prefilter, just the full regex.
+    """
+    try:
+        return {key: _signal_prefilter(p) for key, p in patterns.items()}
+    except Exception as e:
+        logger.warning(f"Scorer: literal prefilters disabled ({type(e).__name__}: {e})")
+        return {key: None for key in patterns}
+
+
+PREFILTERS = _build_prefilters(PATTERNS)
+
+
+def _match_signal(text_lower: str, pattern_key: str) -> bool:
+    anchored, floating = COMPILED_PATTERNS[pattern_key]
+    if anchored is not None and anchored.match(text_lower):
+        return True
+    if floating is None:
+        return False
+    literals = PREFILTERS[pattern_key]
+    if literals is not None:
+        for literal in literals:
+            if literal in text_lower:
+                break
+        else:
+            return False
+    return floating.search(text_lower) is not None
+
+
+def _signals(text_lower: str) -> dict:
+    """Evaluate every signal against already-lowercased text."""
+    return {key: _match_signal(text_lower, key) for key in COMPILED_PATTERNS}
 
-    # Evaluate each signal
-    signals = {key: _check(full_text, key) for key in PATTERNS}
+
+def _check(text: str, pattern_key: str) -> bool:
+    return _match_signal(text.lower(), pattern_key)
+
+
+# ── Result Caches ──────────────────────────────────────────────────────────────
+# RESULT_CACHE memoizes full results by a hash of everything that affects them.
+# SENDER_CACHE memoizes the sender-only signals per sender address. A sender
+# that matches on its own always matches inside the full text, so a cached True
+# is final; a cached False still falls back to searching the full text.
+SENDER_SIGNALS = ("bulk_sender_pattern", "spoofed_sender")
+RESULT_CACHE = TTLCache(maxsize=50_000, ttl=None)
+SENDER_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+
+
+def _result_key(subject, sender, body_snippet, unsubscribe: bool, bulk_precedence: bool) -> bytes:
+    # A JSON array keeps field boundaries: ("a\x00b", "c") and ("a", "b\x00c") differ.
+    raw = json.dumps([subject, sender, body_snippet, unsubscribe, bulk_precedence], ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def _copy_result(result: dict) -> dict:
+    return {**result, "reasons": list(result["reasons"]), "signals": dict(result["signals"])}
+
+
+def _sender_signals(sender: str) -> dict:
+    sender_lower = sender.lower()
+    known = SENDER_CACHE.get(sender_lower)
+    if known is None:
+        known = {key: _match_signal(sender_lower, key) for key in SENDER_SIGNALS}
+        SENDER_CACHE.set(sender_lower, known)
+    return known
+
+
+def cache_stats() -> dict:
+    return {"results": RESULT_CACHE.stats(), "senders": SENDER_CACHE.stats()}
+
+
+def clear_caches():
+    RESULT_CACHE.clear()
+    SENDER_CACHE.clear()
+
+
+# ── Feature Extraction ─────────────────────────────────────────────────────────
+# extract_features() does the text processing for one email once and returns a
+# plain JSON-serialisable record that score_features() and the subject model
+# both read, and that MessageStore can persist next to results.
+#   text      exactly what the signal regexes have always seen, so signals
+#             are unchanged: lowercased "subject sender snippet"
+#   subject   NFKC/casefolded subject with emoji removed; `tokens` is that
+#             subject split the way the model's vectorizer splits it
+# model_tokens() is the one normalisation for model input: every hybrid path
+# and train.py (via fold_text) feed the model the same folded tokens.
+# score_features() stores the raw regex verdicts in the record under
+# PATTERNS_VERSION. As long as PATTERNS is unchanged, re-scoring a stored
+# record after a weight or category-rule change runs no regex at all.
+FEATURES_VERSION = 1
+PATTERNS_VERSION = hashlib.blake2b(json.dumps(PATTERNS, sort_keys=True).encode(), digest_size=8).hexdigest()
+MODEL_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+_EMOJI_RE = re.compile("[\u200d\u2600-\u27bf\ufe0e\ufe0f\U0001f000-\U0001faff]+")
+_URL_RE = re.compile(r"https?://((?:[\w-]+\.)+[a-z]{2,})|\b((?:[\w-]+\.)+[a-z]{2,})/")
+
+
+def fold_text(text: str) -> str:
+    """Lowercase; non-ASCII text is also NFKC-normalised and emoji become spaces."""
+    if text.isascii():
+        return text.lower()
+    return _EMOJI_RE.sub(" ", unicodedata.normalize("NFKC", text).casefold())
+
+
+def _as_text(value) -> str:
+    """Client-supplied field as text, the way the rules' f-string sees it (None is "")."""
+    return "" if value is None else str(value)
+
+
+def model_tokens(subject) -> list:
+    """The subject as the model sees it: fold_text, then MODEL_TOKEN_RE tokens."""
+    return MODEL_TOKEN_RE.findall(fold_text(_as_text(subject)))
+
+
+def _link_hosts(text_lower: str) -> list:
+    hosts = (a or b for a, b in _URL_RE.findall(text_lower))
+    return list(dict.fromkeys(hosts))
+
+
+def _base_features(subject, sender, body_snippet, headers: dict) -> dict:
+    """The part of the record the rules need; score_email stops here."""
+    return {
+        "version":         FEATURES_VERSION,
+        "text":            f"{subject} {sender} {body_snippet}".lower(),
+        "sender":          str(sender).lower(),
+        "unsubscribe":     bool(headers.get("List-Unsubscribe")),
+        "bulk_precedence": headers.get("Precedence") in ("bulk", "list"),
+    }
+
+
+def extract_features(subject: str, sender: str, body_snippet: str = "", headers: dict = None) -> dict:
+    """Normalise one email once into a reusable feature record."""
+    features = _base_features(subject, sender, body_snippet, headers or {})
+    folded = fold_text(_as_text(subject))
+    features.update(
+        sender_domain=parseaddr(str(sender))[1].rpartition("@")[2].lower(),
+        links=_link_hosts(features["text"]),
+        subject=folded,
+        tokens=model_tokens(subject),
+    )
+    return features
+
+
+def score_features(features: dict, use_cache: bool = True) -> dict:
+    """
+    Score a feature record from extract_features(). Fills in the record's
+    `signals` if they are missing or were computed under other PATTERNS.
+    """
+    signals = features.get("signals")
+    if signals is None or features.get("patterns_version") != PATTERNS_VERSION:
+        text_lower = features["text"]
+        if use_cache:
+            known = _sender_signals(features["sender"])
+            signals = {k: known.get(k) or _match_signal(text_lower, k) for k in COMPILED_PATTERNS}
+        else:
+            signals = _signals(text_lower)
+        features["signals"] = dict(signals)
+        features["patterns_version"] = PATTERNS_VERSION
+    signals = dict(signals)
 
     # Extra signals from headers
-    if headers.get("List-Unsubscribe"):
+    if features["unsubscribe"]:
         signals["unsubscribe_footer"] = True
-    if headers.get("Precedence") in ("bulk", "list"):
+    if features["bulk_precedence"]:
         signals["bulk_sender_pattern"] = True
 
     # Compute total score
@@ -201,8 +498,38 @@ def score_email(subject: str, sender: str, body_snippet: str = "", headers: dict
     }
 
 
-def batch_score(emails: list) -> list:
-    """Score a list of email dicts."""
+def score_email(subject: str, sender: str, body_snippet: str = "", headers: dict = None,
+                use_cache: bool = True) -> dict:
+    """
+    Score a single email. Returns full classification result.
+    All local — zero API calls.
+    """
+    headers = headers or {}
+    unsubscribe = bool(headers.get("List-Unsubscribe"))
+    bulk_precedence = headers.get("Precedence") in ("bulk", "list")
+
+    if use_cache:
+        key = _result_key(subject, sender, body_snippet, unsubscribe, bulk_precedence)
+        cached = RESULT_CACHE.get(key)
+        if cached is not None:
+            return _copy_result(cached)
+
+    result = score_features(_base_features(subject, sender, body_snippet, headers), use_cache)
+    if use_cache:
+        RESULT_CACHE.set(key, _copy_result(result))
+    return result
+
+
+def score_records(records: list, hybrid: bool = False) -> list:
+    """Re-score stored feature records, e.g. after a rule or weight change."""
+    results = [score_features(f) for f in records]
+    if hybrid:
+        apply_model(results, features=records)
+    return results
+
+
+def batch_score(emails: list, hybrid: bool = False) -> list:
+    """Score a list of email dicts. `hybrid` blends in the subject model."""
     results = []
     for e in emails:
         result = score_email(
@@ -212,30 +539,271 @@ def batch_score(emails: list) -> list:
             headers=e.get("headers", {}),
         )
         results.append({**e, **result})
+    if hybrid:
+        apply_model(results, [e.get("subject", "") for e in emails])
     return results
 
 
-def inbox_analytics(scored_emails: list) -> dict:
-    """Generate lightweight inbox analytics."""
-    total = len(scored_emails)
-    cats = {}
-    phishing = 0
-    archiveable = 0
-
-    for e in scored_emails:
-        cat = e.get("category", "Uncategorized")
-        cats[cat] = cats.get(cat, 0) + 1
+# ── Parallel Scoring ───────────────────────────────────────────────────────────
+# A persistent process pool, created on first use. Workers import this module,
+# so every worker has COMPILED_PATTERNS ready before it receives a chunk.
+_POOL = None
+_POOL_WORKERS = 0
+
+
+def _init_worker():
+    _signals("")
+
+
+def get_pool(workers: int = None):
+    """Return the shared scoring pool, (re)creating it for a new worker count."""
+    global _POOL, _POOL_WORKERS
+    workers = workers or multiprocessing.cpu_count()
+    if _POOL is None or _POOL_WORKERS != workers:
+        shutdown_pool()
+        _POOL = multiprocessing.Pool(processes=workers, initializer=_init_worker)
+        _POOL_WORKERS = workers
+    return _POOL
+
+
+def shutdown_pool():
+    global _POOL, _POOL_WORKERS
+    if _POOL is not None:
+        _POOL.close()
+        _POOL.join()
+        _POOL, _POOL_WORKERS = None, 0
+
+
+atexit.register(shutdown_pool)
+
+
+def _chunks(items, size: int):
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def score_parallel(emails, workers: int = None, chunk_size: int = 500, max_pending: int = None):
+    """
+    Score an iterable of email dicts across a process pool.
+    Yields results one by one, in input order, as chunks complete.
+    At most `max_pending` chunks (default 2 per worker) are read ahead of the
+    consumer, so memory stays bounded however large the input is.
+    """
+    pool = get_pool(workers)
+    max_pending = max_pending or 2 * _POOL_WORKERS
+    pending = deque()
+    for chunk in _chunks(emails, chunk_size):
+        pending.append(pool.apply_async(batch_score, (chunk,)))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def score_columns(subjects, senders, snippets=None, list_unsubscribe=None, precedence=None,
+                  hybrid: bool = False) -> dict:
+    """
+    Score whole columns of emails at once (lists, NumPy or pandas arrays).
+    Signals are computed as a boolean matrix, scores as one matrix-vector
+    product against WEIGHTS and categories as masks in CATEGORY_MAP order.
+    Returns a dict of arrays; per-email `reasons` are not built in this mode.
+    With `hybrid`, undecided rows also get `model_probability` (NaN elsewhere)
+    and a blended `confidence`, as in apply_model.
+    """
+    import numpy as np
+
+    n = len(subjects)
+    if snippets is None:
+        snippets = [""] * n
+    texts = [f"{subj} {sndr} {snip}".lower() for subj, sndr, snip in zip(subjects, senders, snippets)]
+
+    keys = list(COMPILED_PATTERNS)
+    matrix = np.empty((n, len(keys)), dtype=bool)
+    for i, key in enumerate(keys):
+        matrix[:, i] = np.fromiter((_match_signal(t, key) for t in texts), dtype=bool, count=n)
+
+    # Extra signals from headers
+    if list_unsubscribe is not None:
+        matrix[:, keys.index("unsubscribe_footer")] |= np.fromiter(
+            (bool(v) for v in list_unsubscribe), dtype=bool, count=n)
+    if precedence is not None:
+        matrix[:, keys.index("bulk_sender_pattern")] |= np.isin(
+            np.asarray(precedence, dtype=object), ["bulk", "list"])
+
+    weights = np.array([WEIGHTS[k] for k in keys], dtype=np.int64)
+    scores = matrix.astype(np.int64) @ weights
+
+    # Category index per row: first matching rule wins, last slot is "Uncategorized"
+    columns = {key: matrix[:, i] for i, key in enumerate(keys)}
+    names = list(CATEGORY_MASKS) + ["Uncategorized"]
+    conditions = [rule(columns) for rule in CATEGORY_MASKS.values()]
+    idx = np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+    idx[(idx == len(conditions)) & (scores > 10)] = names.index("Promotion")
+
+    confidence = np.clip(50 + scores, 30, 99)
+    result = {"confidence": confidence, "signals": matrix, "signal_names": keys}
+
+    if hybrid:
+        decisive = matrix[:, [keys.index(k) for k in DECISIVE_SIGNALS]].any(axis=1) | (np.abs(scores) >= DECISIVE_SCORE)
+        pending = np.flatnonzero(~decisive)
+        probs = np.full(n, np.nan)
+        if len(pending):
+            probs[pending] = model_unwanted_proba(
+                ["" if subjects[i] is None else subjects[i] for i in pending.tolist()])
+            confidence[pending] = np.clip(np.round(_blend(confidence[pending], probs[pending])), 30, 99)
+            promote = (idx == len(conditions)) & (confidence > MODEL_PROMOTION_CONFIDENCE) & ~decisive
+            idx[promote] = names.index("Promotion")
+        result["model_probability"] = probs
+
+    result["category"] = np.array(names, dtype=object)[idx]
+    result["label"] = np.array([LABEL_FOR_CATEGORY.get(c, "AI/Uncategorized") for c in names], dtype=object)[idx]
+    result["archive"] = np.array([c in REMOVE_FROM_INBOX for c in names], dtype=bool)[idx]
+    result["score"] = scores
+    return result
+
+
+# ── Hybrid Scoring ─────────────────────────────────────────────────────────────
+# Blends the subject model from train.py (model_runtime.TextModel, NumPy only)
+# into `confidence`. The model runs once per batch, and only on emails the
+# rules leave undecided: any of DECISIVE_SIGNALS (OTP, phishing) or a large
+# |score| keeps the rule verdict as it is.
+MODEL_WEIGHT = 0.4
+DECISIVE_SCORE = 40
+DECISIVE_SIGNALS = ("otp_transactional", "suspicious_link", "spoofed_sender", "urgency_tactic")
+# Same cut-off as the rule fallback (`total > 10` -> confidence above 60).
+MODEL_PROMOTION_CONFIDENCE = 60
+
+
+def is_decisive(signals: dict, score: int) -> bool:
+    return abs(score) >= DECISIVE_SCORE or any(signals[k] for k in DECISIVE_SIGNALS)
+
+
+def model_unwanted_proba(subjects, tokenized: bool = False):
+    """
+    P(Unwanted) for each subject, as one sparse batch through the model.
+    Raw subjects go through model_tokens(); with `tokenized`, `subjects` are
+    already token lists from extract_features().
+    """
+    from model_runtime import load_model
+
+    if not tokenized:
+        subjects, tokenized = [model_tokens(s) for s in subjects], True
+    model = load_model()
+    if tokenized and model.meta["token_pattern"] != MODEL_TOKEN_RE.pattern:
+        subjects, tokenized = [" ".join(tokens) for tokens in subjects], False
+    column = list(model.classes).index("Unwanted")
+    return model.predict_proba(subjects, tokenized=tokenized)[:, column]
+
+
+def _blend(rule_confidence, p_unwanted):
+    return (1 - MODEL_WEIGHT) * rule_confidence + MODEL_WEIGHT * 100 * p_unwanted
+
+
+def apply_model(results: list, subjects: list = None, features: list = None) -> list:
+    """
+    Blend the model into score_email results in place. Adds `model_probability`
+    (None where the rules were decisive); an Uncategorized email the model
+    pushes over MODEL_PROMOTION_CONFIDENCE becomes a Promotion. The model reads
+    the tokens from `features` records when given, else model_tokens() of the
+    raw `subjects`.
+    """
+    pending = [i for i, r in enumerate(results) if not is_decisive(r["signals"], r["score"])]
+    for r in results:
+        r["model_probability"] = None
+    if not pending:
+        return results
+
+    if features is not None:
+        probs = model_unwanted_proba([features[i]["tokens"] for i in pending], tokenized=True)
+    else:
+        probs = model_unwanted_proba([subjects[i] or "" for i in pending])
+    for i, p in zip(pending, probs.tolist()):
+        r = results[i]
+        r["model_probability"] = round(p, 4)
+        r["confidence"] = min(99, max(30, round(_blend(r["confidence"], p))))
+        if r["category"] == "Uncategorized" and r["confidence"] > MODEL_PROMOTION_CONFIDENCE:
+            r.update(category="Promotion", label=LABEL_FOR_CATEGORY["Promotion"],
+                     archive="Promotion" in REMOVE_FROM_INBOX)
+            r["reasons"] = [x for x in r["reasons"] if x != "No strong signals detected"]
+        if r["category"] != "Uncategorized" or p >= 0.5:
+            r["reasons"].append(f"Subject model: {p:.0%} likely unwanted")
+    return results
+
+
+class InboxAnalytics:
+    """
+    Mergeable running totals behind inbox_analytics.
+    Partial aggregates (per worker, per day) combine exactly with merge().
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.categories = {}
+        self.phishing = 0
+        self.archiveable = 0
+
+    def add(self, scored: dict):
+        cat = scored.get("category", "Uncategorized")
+        self.categories[cat] = self.categories.get(cat, 0) + 1
+        self.total += 1
         if cat == "Phishing Risk":
-            phishing += 1
-        if e.get("archive"):
-            archiveable += 1
+            self.phishing += 1
+        if scored.get("archive"):
+            self.archiveable += 1
+        return self
 
-    clutter_score = round((archiveable / total * 100) if total else 0)
+    def add_many(self, scored_emails):
+        for e in scored_emails:
+            self.add(e)
+        return self
 
-    return {
-        "total":          total,
-        "categories":     cats,
-        "phishing_count": phishing,
-        "archiveable":    archiveable,
-        "clutter_score":  clutter_score,
-    }
+    def merge(self, other: "InboxAnalytics"):
+        self.total += other.total
+        self.phishing += other.phishing
+        self.archiveable += other.archiveable
+        for cat, n in other.categories.items():
+            self.categories[cat] = self.categories.get(cat, 0) + n
+        return self
+
+    def snapshot(self) -> dict:
+        total = self.total
+        return {
+            "total":          total,
+            "categories":     dict(self.categories),
+            "phishing_count": self.phishing,
+            "archiveable":    self.archiveable,
+            "clutter_score":  round((self.archiveable / total * 100) if total else 0),
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "InboxAnalytics":
+        """
+        Rebuild from snapshot(). Raises ValueError for counts that add() could
+        never have produced: negative or non-integer counts, categories that
+        do not sum to the total, or phishing/archiveable counts that disagree.
+        """
+        acc = cls()
+        acc.total = _count(data.get("total", 0))
+        acc.categories = {str(k): _count(v) for k, v in (data.get("categories") or {}).items()}
+        acc.phishing = _count(data.get("phishing_count", 0))
+        acc.archiveable = _count(data.get("archiveable", 0))
+        if sum(acc.categories.values()) != acc.total:
+            raise ValueError("category counts do not add up to the total")
+        if acc.phishing != acc.categories.get("Phishing Risk", 0) or acc.archiveable > acc.total:
+            raise ValueError("inconsistent phishing or archiveable count")
+        return acc
+
+
+def _count(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"invalid count: {value!r}")
+    return value
+
+
+def inbox_analytics(scored_emails: list) -> dict:
+    """Generate lightweight inbox analytics."""
+    return InboxAnalytics().add_many(scored_emails).snapshot()
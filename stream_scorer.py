@@ -0,0 +1,151 @@
+"""
+InboxAI — Streaming Scorer
+Scores JSONL, mbox or EML-directory exports one record at a time and writes
+results as JSONL, so memory stays flat regardless of archive size. A .json
+file holding one JSON array (e.g. classified_emails.json) is also accepted;
+it is loaded whole.
+
+Usage: python stream_scorer.py INPUT OUTPUT.jsonl
+  INPUT  a .jsonl file (one email dict per line), a .json array, an mbox
+         file, or a directory of .eml files
+"""
+
+import json
+import os
+import re
+import sys
+from email import policy
+from email.parser import BytesParser
+
+from scorer import InboxAnalytics, score_email
+
+SNIPPET_CHARS = 200
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+
+
+# ── Readers ────────────────────────────────────────────────────────────────────
+def iter_jsonl(path: str):
+    """Yield one dict per non-empty line of a JSONL file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_json(path: str):
+    """Yield the records of a .json/.jsonl file: the items of a top-level array, else one per line."""
+    with open(path, encoding="utf-8") as f:
+        first = next((c for line in f for c in line if not c.isspace()), "")
+    if first == "[":
+        with open(path, encoding="utf-8") as f:
+            yield from json.load(f)
+    else:
+        yield from iter_jsonl(path)
+
+
+def _snippet(msg) -> str:
+    try:
+        body = msg.get_body(preferencelist=("plain", "html"))
+        if body is None:
+            return ""
+        text = body.get_content()
+    except (KeyError, LookupError, UnicodeError):
+        return ""
+    if body.get_content_subtype() == "html":
+        text = _TAG_RE.sub(" ", text)
+    return _WS_RE.sub(" ", text).strip()[:SNIPPET_CHARS]
+
+
+def message_to_record(msg) -> dict:
+    """Convert a parsed email.message into the dict shape scorer expects."""
+    headers = {}
+    for name in ("List-Unsubscribe", "Precedence"):
+        if msg.get(name):
+            headers[name] = str(msg[name]).strip()
+    return {
+        "id":      str(msg.get("Message-ID", "")).strip(),
+        "subject": str(msg.get("Subject", "")),
+        "from":    str(msg.get("From", "")),
+        "snippet": _snippet(msg),
+        "headers": headers,
+    }
+
+
+def _parse_bytes(raw: bytes) -> dict:
+    return message_to_record(BytesParser(policy=policy.default).parsebytes(raw))
+
+
+def iter_mbox(path: str):
+    """
+    Yield one record per message of an mbox file.
+    Reads line by line and only ever holds the current message in memory,
+    unlike mailbox.mbox which indexes the whole file first.
+    """
+    lines = []
+    prev_blank = True
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From ") and prev_blank:
+                if lines:
+                    yield _parse_bytes(b"".join(lines))
+                lines = []
+            else:
+                lines.append(line)
+            prev_blank = not line.strip()
+    if lines:
+        yield _parse_bytes(b"".join(lines))
+
+
+def iter_eml_dir(path: str):
+    """Yield one record per .eml file in a directory."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(".eml"):
+                with open(entry.path, "rb") as f:
+                    record = _parse_bytes(f.read())
+                record["id"] = record["id"] or entry.name
+                yield record
+
+
+def iter_records(path: str):
+    """Pick a reader from the input type: directory, .jsonl/.json, else mbox."""
+    if os.path.isdir(path):
+        return iter_eml_dir(path)
+    if path.lower().endswith((".jsonl", ".json")):
+        return iter_json(path)
+    return iter_mbox(path)
+
+
+# ── Pipeline ───────────────────────────────────────────────────────────────────
+def score_stream(records):
+    """Lazily score an iterable of email dicts."""
+    for e in records:
+        result = score_email(
+            subject=e.get("subject", ""),
+            sender=e.get("from", ""),
+            body_snippet=e.get("snippet", ""),
+            headers=e.get("headers", {}),
+        )
+        yield {**e, **result}
+
+
+def score_file(src: str, dst: str) -> dict:
+    """
+    Score every record in `src` and append results to `dst` as JSONL.
+    Returns the same summary as inbox_analytics, counted on the fly.
+    """
+    analytics = InboxAnalytics()
+    with open(dst, "w", encoding="utf-8") as out:
+        for scored in score_stream(iter_records(src)):
+            out.write(json.dumps(scored, ensure_ascii=False) + "\n")
+            analytics.add(scored)
+    return analytics.snapshot()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    print(json.dumps(score_file(sys.argv[1], sys.argv[2]), indent=2))
@@ -0,0 +1,27 @@
+-- InboxAI — atomic scan counter
+-- Adds one scan for p_email on p_day unless p_limit is already reached, in a
+-- single UPDATE so concurrent requests cannot lose increments or overshoot
+-- the limit. A count stored for an earlier day is treated as zero, so no
+-- separate daily reset write is needed.
+-- Returns the new scans_today, NULL when the limit blocked the increment, or
+-- -1 when p_email has no users row.
+
+create or replace function increment_scan(p_email text, p_limit integer default null,
+                                          p_day date default current_date)
+returns integer
+language sql
+as $$
+  with updated as (
+    update users
+       set scans_today = case when last_reset_date::date = p_day
+                              then coalesce(scans_today, 0) else 0 end + 1,
+           last_reset_date = p_day
+     where email = p_email
+       and (p_limit is null
+            or case when last_reset_date::date = p_day
+                    then coalesce(scans_today, 0) else 0 end < p_limit)
+    returning scans_today
+  )
+  select coalesce((select scans_today from updated),
+                  case when exists (select 1 from users where email = p_email) then null else -1 end);
+$$;
@@ -0,0 +1,31 @@
+-- InboxAI — shared inbox analytics
+-- Running per-user totals live in users.analytics as
+--   {"total", "categories": {name: n}, "phishing_count", "archiveable"}
+-- and are merged here in a single UPDATE, so partial aggregates posted to
+-- different workers (or concurrently) all land in the same row.
+-- Returns the merged analytics, or NULL when p_email has no row.
+
+alter table users add column if not exists analytics jsonb;
+
+create or replace function merge_analytics(p_email text, p_delta jsonb)
+returns jsonb
+language sql
+as $$
+  update users
+     set analytics = jsonb_build_object(
+           'total',          coalesce((analytics->>'total')::bigint, 0)
+                             + coalesce((p_delta->>'total')::bigint, 0),
+           'phishing_count', coalesce((analytics->>'phishing_count')::bigint, 0)
+                             + coalesce((p_delta->>'phishing_count')::bigint, 0),
+           'archiveable',    coalesce((analytics->>'archiveable')::bigint, 0)
+                             + coalesce((p_delta->>'archiveable')::bigint, 0),
+           'categories',     coalesce((
+             select jsonb_object_agg(key, n)
+               from (select key, sum(value::bigint) as n
+                       from (select * from jsonb_each_text(coalesce(analytics->'categories', '{}'))
+                             union all
+                             select * from jsonb_each_text(coalesce(p_delta->'categories', '{}'))) c
+                      group by key) s), '{}'::jsonb))
+   where email = p_email
+  returning analytics;
+$$;
@@ -0,0 +1,8 @@
+-- InboxAI — refresh token rotation
+-- Each user has one live refresh token, identified by the `jti` claim stored
+-- here. /auth/refresh swaps it for a new one with a conditional PATCH
+-- (refresh_jti=eq.<old>), so every refresh token works once; presenting a
+-- used one again clears the column, which revokes the session. Login sets it,
+-- /logout clears it.
+
+alter table users add column if not exists refresh_jti text;
@@ -0,0 +1,261 @@
+"""
+InboxAI — Supabase Data Access
+Thin client for the Supabase REST (PostgREST) `users` table: one pooled
+keep-alive session, connect/read timeouts and retries with jittered backoff.
+"""
+
+import json
+import random
+import time
+from datetime import date
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+POOL_SIZE = 20
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Emails per `in.(...)` filter, keeps bulk request URLs well under server limits.
+BULK_CHUNK = 200
+
+
+# Compare-and-swap attempts when the increment_scan RPC is not installed.
+CAS_ATTEMPTS = 5
+
+
+class SupabaseError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class UserNotFound(SupabaseError):
+    """The users row a counter update needs does not exist."""
+
+
+def _merge_counts(stored: dict, delta: dict) -> dict:
+    """Add the counts of analytics `delta` to `stored` (see merge_analytics.sql)."""
+    stored = stored or {}
+    merged = {key: (stored.get(key) or 0) + (delta.get(key) or 0)
+              for key in ("total", "phishing_count", "archiveable")}
+    categories = dict(stored.get("categories") or {})
+    for name, n in (delta.get("categories") or {}).items():
+        categories[name] = categories.get(name, 0) + n
+    merged["categories"] = categories
+    return merged
+
+
+def _in_filter(values) -> str:
+    quoted = ",".join('"' + str(v).replace('"', '\\"') + '"' for v in values)
+    return f"in.({quoted})"
+
+
+class SupabaseClient:
+    def __init__(self, url: str, key: str, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 max_retries: int = MAX_RETRIES, pool_size: int = POOL_SIZE):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.key)
+
+    def _headers(self, prefer: str = None) -> dict:
+        headers = {
+            "apikey": self.key,
+            "Authorization": f"Bearer {self.key}",
+            "Content-Type": "application/json",
+        }
+        if prefer:
+            headers["Prefer"] = prefer
+        return headers
+
+    def request(self, method: str, path: str, params=None, json=None, prefer: str = None,
+                idempotent: bool = True):
+        """
+        Send a request to /rest/v1/<path> and return the decoded JSON body.
+        Connection errors, timeouts and 429/5xx responses are retried with
+        full-jitter exponential backoff; anything else raises SupabaseError.
+        With idempotent=False (counters and other writes that must not apply
+        twice) only connection errors, including connect timeouts, are
+        retried: after a read timeout or a 5xx the write may already have
+        been applied, so those raise at once.
+        """
+        url = f"{self.url}/rest/v1/{path}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(
+                    method, url, params=params, json=json,
+                    headers=self._headers(prefer), timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                if not idempotent and isinstance(e, requests.ReadTimeout):
+                    raise SupabaseError(f"{method} {path} timed out: {e}")
+            else:
+                if response.status_code < 300:
+                    return response.json() if response.content else None
+                error = SupabaseError(
+                    f"{method} {path} -> {response.status_code}: {response.text[:200]}", response.status_code
+                )
+                if not idempotent or response.status_code not in RETRY_STATUSES:
+                    raise error
+            if attempt < self.max_retries:
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        raise SupabaseError(f"{method} {path} failed after {self.max_retries + 1} attempts: {error}")
+
+    # ── Users ──────────────────────────────────────────────────────────────────
+    def get_user(self, email: str):
+        rows = self.request("GET", "users", params={"email": f"eq.{email}"})
+        return rows[0] if rows else None
+
+    def upsert_user(self, email: str, data: dict):
+        rows = self.request("POST", "users", json={"email": email, **data},
+                            prefer="resolution=merge-duplicates,return=representation")
+        return rows[0] if rows else None
+
+    def update_user(self, email: str, data: dict):
+        rows = self.request("PATCH", "users", params={"email": f"eq.{email}"}, json=data,
+                            prefer="return=representation")
+        return rows[0] if rows else None
+
+    # ── Bulk ───────────────────────────────────────────────────────────────────
+    def get_users(self, emails) -> list:
+        """Fetch many users, BULK_CHUNK emails per `in.(...)` query."""
+        emails = list(emails)
+        rows = []
+        for i in range(0, len(emails), BULK_CHUNK):
+            rows += self.request("GET", "users", params={"email": _in_filter(emails[i:i + BULK_CHUNK])}) or []
+        return rows
+
+    def update_users(self, emails, data: dict) -> list:
+        """Apply the same update to many users; returns the updated rows."""
+        emails = list(emails)
+        rows = []
+        for i in range(0, len(emails), BULK_CHUNK):
+            rows += self.request("PATCH", "users", params={"email": _in_filter(emails[i:i + BULK_CHUNK])},
+                                 json=data, prefer="return=representation") or []
+        return rows
+
+    # ── Counters ───────────────────────────────────────────────────────────────
+    def rpc(self, name: str, params: dict, idempotent: bool = True):
+        return self.request("POST", f"rpc/{name}", json=params, idempotent=idempotent)
+
+    def increment_scan(self, email: str, limit: int = None, day: str = None):
+        """
+        Atomically add one scan for `day` (ISO date) unless `limit` is reached.
+        A count stored for an earlier day counts as zero. Returns the new
+        scans_today, or None when the limit blocked it; raises UserNotFound
+        when the user has no row.
+        Uses the increment_scan RPC (supabase/increment_scan.sql); if that is
+        not installed, falls back to a compare-and-swap conditional PATCH.
+        """
+        day = day or str(date.today())
+        try:
+            scans = self.rpc("increment_scan", {"p_email": email, "p_limit": limit, "p_day": day},
+                             idempotent=False)
+        except SupabaseError as e:
+            if e.status != 404:
+                raise
+        else:
+            if scans == -1:
+                raise UserNotFound(f"increment_scan: no users row for {email}")
+            return scans
+
+        for _ in range(CAS_ATTEMPTS):
+            user = self.get_user(email)
+            if user is None:
+                raise UserNotFound(f"increment_scan: no users row for {email}")
+            stored_scans = user.get("scans_today")
+            stored_day = user.get("last_reset_date")
+            current = (stored_scans or 0) if stored_day == day else 0
+            if limit is not None and current >= limit:
+                return None
+            rows = self.request(
+                "PATCH", "users",
+                params={
+                    "email": f"eq.{email}",
+                    "scans_today": "is.null" if stored_scans is None else f"eq.{stored_scans}",
+                    "last_reset_date": "is.null" if stored_day is None else f"eq.{stored_day}",
+                },
+                json={"scans_today": current + 1, "last_reset_date": day},
+                prefer="return=representation", idempotent=False,
+            )
+            if rows:
+                return rows[0]["scans_today"]
+        raise SupabaseError(f"increment_scan: gave up after {CAS_ATTEMPTS} conflicting updates")
+
+    # ── Analytics ──────────────────────────────────────────────────────────────
+    def get_analytics(self, email: str):
+        rows = self.request("GET", "users", params={"email": f"eq.{email}", "select": "analytics"})
+        return rows[0].get("analytics") if rows else None
+
+    def merge_analytics(self, email: str, delta: dict):
+        """
+        Add the counts in `delta` to the user's stored analytics and return the
+        merged totals (None if the user has no row). Uses the merge_analytics
+        RPC (supabase/merge_analytics.sql), else a compare-and-swap PATCH.
+        """
+        try:
+            return self.rpc("merge_analytics", {"p_email": email, "p_delta": delta}, idempotent=False)
+        except SupabaseError as e:
+            if e.status != 404:
+                raise
+
+        for _ in range(CAS_ATTEMPTS):
+            user = self.get_user(email)
+            if user is None:
+                return None
+            stored = user.get("analytics")
+            merged = _merge_counts(stored, delta)
+            rows = self.request(
+                "PATCH", "users",
+                params={
+                    "email": f"eq.{email}",
+                    "analytics": "is.null" if stored is None else f"eq.{json.dumps(stored)}",
+                },
+                json={"analytics": merged},
+                prefer="return=representation", idempotent=False,
+            )
+            if rows:
+                return rows[0]["analytics"]
+        raise SupabaseError(f"merge_analytics: gave up after {CAS_ATTEMPTS} conflicting updates")
+
+    # ── Refresh Tokens ─────────────────────────────────────────────────────────
+    def get_refresh_jti(self, email: str):
+        rows = self.request("GET", "users", params={"email": f"eq.{email}", "select": "refresh_jti"})
+        return rows[0].get("refresh_jti") if rows else None
+
+    def swap_refresh_jti(self, email: str, old: str, new: str) -> bool:
+        """
+        Replace the user's refresh_jti `old` with `new` in one conditional
+        PATCH (supabase/refresh_jti.sql). False when the stored jti is not
+        `old`: that refresh token was already used or revoked.
+        """
+        rows = self.request(
+            "PATCH", "users",
+            params={"email": f"eq.{email}", "refresh_jti": f"eq.{old}"},
+            json={"refresh_jti": new},
+            prefer="return=representation", idempotent=False,
+        )
+        return bool(rows)
+
+    def reset_stale_counters(self, day: str = None):
+        """
+        Bulk-zero counters stored for days before `day`. Only housekeeping:
+        readers already treat stale counts as zero.
+        """
+        day = day or str(date.today())
+        self.request(
+            "PATCH", "users",
+            params={"last_reset_date": f"lt.{day}", "scans_today": "gt.0"},
+            json={"scans_today": 0}, prefer="return=minimal",
+        )
@@ -0,0 +1,104 @@
+"""
+InboxAI — Google Token Verification
+Verifies Google ID tokens and OAuth access tokens for /auth/verify-google.
+Google's signing certificates are cached until their Cache-Control expiry,
+verified tokens are cached for their remaining lifetime, and all calls go
+through one pooled session with timeouts.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.oauth2 import id_token
+from google.auth.transport import requests as google_requests
+
+from ttl_cache import TTLCache
+
+TOKENINFO_URL = "https://oauth2.googleapis.com/tokeninfo"
+TIMEOUT = (3.05, 5)
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+logger = logging.getLogger("inboxai")
+
+
+class CachingRequest(google_requests.Request):
+    """
+    google-auth transport that keeps successful GET responses (the signing
+    certificates) until the max-age Google sends with them, instead of
+    re-downloading them on every verification.
+    """
+
+    def __init__(self, session=None, timeout=TIMEOUT):
+        super().__init__(session=session)
+        self._timeout = timeout
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        if method != "GET":
+            return super().__call__(url, method, body, headers, timeout or self._timeout, **kwargs)
+        with self._lock:
+            entry = self._cache.get(url)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        response = super().__call__(url, method, body, headers, timeout or self._timeout, **kwargs)
+        match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+        if response.status == 200 and match:
+            with self._lock:
+                self._cache[url] = (response, time.monotonic() + int(match.group(1)))
+        return response
+
+
+def _looks_like_jwt(token: str) -> bool:
+    return token.count(".") == 2
+
+
+class GoogleTokenVerifier:
+    def __init__(self, client_id: str, timeout=TIMEOUT, cache_size: int = 10_000):
+        self.client_id = client_id
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
+        self.transport = CachingRequest(self.session, timeout)
+        self.results = TTLCache(maxsize=cache_size)
+
+    def _verify_id_token(self, token: str):
+        idinfo = id_token.verify_oauth2_token(token, self.transport, self.client_id)
+        return idinfo["email"], idinfo["exp"] - time.time()
+
+    def _verify_access_token(self, token: str):
+        resp = self.session.get(TOKENINFO_URL, params={"access_token": token}, timeout=self.timeout)
+        if resp.status_code != 200:
+            return None, 0
+        info = resp.json()
+        return info.get("email"), int(info.get("expires_in", 0))
+
+    def verify(self, token: str):
+        """Return the Google account email for `token`, or None if invalid."""
+        key = hashlib.sha256(token.encode()).digest()
+        email = self.results.get(key)
+        if email is not None:
+            return email
+
+        email, ttl = None, 0
+        # Access tokens from the extension are not JWTs; skip straight to tokeninfo.
+        if _looks_like_jwt(token):
+            try:
+                email, ttl = self._verify_id_token(token)
+            except Exception:
+                pass
+        if not email:
+            try:
+                email, ttl = self._verify_access_token(token)
+            except Exception as e:
+                logger.error(f"Auth Error (Google Token): {e}")
+
+        if email and ttl > 0:
+            self.results.set(key, email, ttl=ttl)
+        return email
@@ -1,31 +1,202 @@
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+"""
+InboxAI — Model Training
+Default: full refit of TF-IDF + LogisticRegression on emails.csv.
+--online: out-of-core HashingVectorizer + SGDClassifier.partial_fit over
+chunked CSV/JSONL reads, checkpointed after every chunk so an interrupted run
+resumes where it stopped. Memory is bounded by --chunk-size, not corpus size.
+--feedback: small online update of the checkpoint from user corrections.
+
+Usage: python train.py
+       python train.py --online [--input emails.csv ...] [--epochs 1] [--chunk-size 10000]
+       python train.py --feedback corrections.jsonl
+"""
+
+import argparse
+import csv
+import os
 import pickle
+from itertools import islice
+
+from model_runtime import MODEL_DIR, export_hashed_model, export_model
+from scorer import fold_text
+from stream_scorer import iter_json
+
+CLASSES = ["Unwanted", "Wanted"]
+CHECKPOINT_PATH = "online_checkpoint.pkl"
+N_FEATURES = 2 ** 18
+CHUNK_SIZE = 10_000
+# Corrections are rare but deliberate, so each one counts as several rows.
+FEEDBACK_WEIGHT = 5.0
+
+
+def train_full(path: str = "emails.csv"):
+    import pandas as pd
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    # 1. Load labeled CSV
+    df = pd.read_csv(path)
+
+    # 2. Drop rows with missing values
+    df = df.dropna()
+
+    if df.empty:
+        print(f"❌ No labeled data found in {path}")
+        exit()
+
+    # 3. Train model (on subjects folded like scorer.model_tokens folds them at scoring time)
+    vectorizer = TfidfVectorizer()
+    X = vectorizer.fit_transform(df["subject"].map(fold_text))
+    y = df["label"]
+
+    model = LogisticRegression(max_iter=200)
+    model.fit(X, y)
+
+    # 4. Save model + vectorizer
+    with open("vectorizer.pkl", "wb") as f:
+        pickle.dump(vectorizer, f)
+
+    with open("model.pkl", "wb") as f:
+        pickle.dump(model, f)
+
+    # 5. Export .npy arrays for the NumPy-only runtime (model_runtime.py)
+    export_model(vectorizer, model, MODEL_DIR)
+
+    print("✅ Model trained and saved as vectorizer.pkl & model.pkl (+ model/ arrays)")
+
+
+# ── Online Training ────────────────────────────────────────────────────────────
+def make_vectorizer():
+    from sklearn.feature_extraction.text import HashingVectorizer
+    # Stateless: no vocabulary to fit, so any chunk can be transformed on its own.
+    return HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm="l2")
+
+
+def make_model():
+    from sklearn.linear_model import SGDClassifier
+    return SGDClassifier(loss="log_loss", alpha=1e-5, random_state=0)
+
+
+def iter_labeled(path: str):
+    """
+    Yield (subject, label) from a CSV, JSONL or JSON-array file, skipping unlabeled rows.
+    Subjects are passed through fold_text, the normalisation used at scoring time.
+    """
+    if path.endswith((".jsonl", ".json")):
+        rows = iter_json(path)
+    else:
+        rows = _iter_csv(path)
+    for row in rows:
+        subject, label = row.get("subject"), row.get("label")
+        if subject and label in CLASSES:
+            yield fold_text(subject), label
+
+
+def _iter_csv(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def iter_chunks(paths: list, chunk_size: int, skip: int = 0):
+    rows = (row for path in paths for row in iter_labeled(path))
+    rows = islice(rows, skip, None)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_checkpoint(path: str = CHECKPOINT_PATH):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_checkpoint(state: dict, path: str = CHECKPOINT_PATH):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp, path)
+
+
+def train_online(paths: list, epochs: int = 1, chunk_size: int = CHUNK_SIZE,
+                 checkpoint: str = CHECKPOINT_PATH, out_dir: str = MODEL_DIR, resume: bool = True) -> dict:
+    """
+    partial_fit over `paths` for `epochs` passes, one chunk in memory at a
+    time. The checkpoint records the model and how far into the current epoch
+    it got; with `resume`, an interrupted run continues from there and a
+    finished one is the starting point for the next run (e.g. nightly).
+    """
+    vectorizer = make_vectorizer()
+    if resume and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        if state.get("done"):
+            state.update(epoch=0, rows=0, done=False)
+            print(f"↻ Continuing from the model trained on {state['trained']} rows")
+        else:
+            print(f"↻ Resuming at epoch {state['epoch'] + 1}, row {state['rows']}")
+    else:
+        state = {"model": make_model(), "epoch": 0, "rows": 0, "trained": 0, "done": False}
+    model = state["model"]
+
+    while state["epoch"] < epochs:
+        for chunk in iter_chunks(paths, chunk_size, skip=state["rows"]):
+            subjects, labels = zip(*chunk)
+            model.partial_fit(vectorizer.transform(subjects), labels, classes=CLASSES)
+            state["rows"] += len(chunk)
+            state["trained"] += len(chunk)
+            save_checkpoint(state, checkpoint)
+        state["epoch"] += 1
+        state["rows"] = 0
+        save_checkpoint(state, checkpoint)
+    state["done"] = True
+    save_checkpoint(state, checkpoint)
+
+    if state["trained"]:
+        export_hashed_model(vectorizer, model, out_dir)
+    return state
 
-# 1. Load labeled CSV
-df = pd.read_csv("emails.csv")
 
-# 2. Drop rows with missing values
-df = df.dropna()
+def apply_feedback(path: str, checkpoint: str = CHECKPOINT_PATH, out_dir: str = MODEL_DIR) -> int:
+    """Online update of the checkpointed model from a CSV/JSONL of corrected labels."""
+    import numpy as np
 
-if df.empty:
-    print("❌ No labeled data found in emails.csv")
-    exit()
+    state = load_checkpoint(checkpoint)
+    vectorizer = make_vectorizer()
+    count = 0
+    for chunk in iter_chunks([path], CHUNK_SIZE):
+        subjects, labels = zip(*chunk)
+        state["model"].partial_fit(vectorizer.transform(subjects), labels, classes=CLASSES,
+                                   sample_weight=np.full(len(chunk), FEEDBACK_WEIGHT))
+        count += len(chunk)
+    state["trained"] += count
+    save_checkpoint(state, checkpoint)
+    export_hashed_model(vectorizer, state["model"], out_dir)
+    return count
 
-# 3. Train model
-vectorizer = TfidfVectorizer()
-X = vectorizer.fit_transform(df["subject"])
-y = df["label"]
 
-model = LogisticRegression(max_iter=200)
-model.fit(X, y)
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--online", action="store_true")
+    parser.add_argument("--feedback", metavar="FILE")
+    parser.add_argument("--input", nargs="+", default=["emails.csv"])
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--out", default=MODEL_DIR)
+    parser.add_argument("--fresh", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
 
-# 4. Save model + vectorizer
-with open("vectorizer.pkl", "wb") as f:
-    pickle.dump(vectorizer, f)
+    if args.feedback:
+        count = apply_feedback(args.feedback, args.checkpoint, args.out)
+        print(f"✅ Applied {count} corrections, exported to {args.out}")
+    elif args.online:
+        state = train_online(args.input, args.epochs, args.chunk_size, args.checkpoint, args.out,
+                             resume=not args.fresh)
+        print(f"✅ Online model trained on {state['trained']} rows, exported to {args.out}")
+    else:
+        train_full(args.input[0])
 
-with open("model.pkl", "wb") as f:
-    pickle.dump(model, f)
 
-print("✅ Model trained and saved as vectorizer.pkl & model.pkl")
+if __name__ == "__main__":
+    main()